@@ -0,0 +1,105 @@
+"""
+Graceful connection draining for deploys. When the server is told to stop, its open event streams are
+closed a batch at a time over SHUTDOWN_DRAIN_SECONDS instead of all at once, and every client is first
+sent an SSE `retry:` with its own random delay. Reconnects then trickle into the next instance rather than
+all hitting it in the same second.
+"""
+import asyncio
+import logging
+import math
+import random
+import signal
+import threading
+
+from uvicorn.server import HANDLED_SIGNALS
+
+from rooms import RoomRegistry
+
+# Seconds between two drained batches, the batch size is picked to spread the drain over the whole window
+DRAIN_BATCH_INTERVAL_SECONDS = 0.25
+# Range of the reconnect delay (ms) handed to each drained client, so reconnects don't line up with the batches
+DRAIN_RETRY_MIN_MILLIS = 1000
+DRAIN_RETRY_MAX_MILLIS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def jittered_retry_millis(min_millis: int = DRAIN_RETRY_MIN_MILLIS, max_millis: int = DRAIN_RETRY_MAX_MILLIS) -> int:
+    return random.randint(min_millis, max_millis)
+
+
+def encode_retry_frame(retry_millis: int) -> bytes:
+    """SSE frame telling the client how long to wait before reconnecting (the WebSocket client reads it too)."""
+    return b"retry: " + str(retry_millis).encode() + b"\r\n\r\n"
+
+
+class ConnectionDrainer:
+    """
+    Wraps the exit signal handlers the server installed (uvicorn's, already wrapped by sse-starlette), so the
+    first SIGTERM / SIGINT drains this worker's event streams before the server starts shutting down.
+    A second signal skips whatever is left of the drain.
+    """
+
+    def __init__(self, rooms: RoomRegistry, drain_seconds: float):
+        self.rooms = rooms
+        self.drain_seconds = drain_seconds
+        self.draining = False
+        self.loop = None
+        self.drain_task = None
+        # Signal -> the handler it had before start
+        self.previous_handlers = {}
+
+    def start(self) -> None:
+        """
+        Call it at lifespan startup: however uvicorn was launched, it has installed its signal handlers by then,
+        and keeps them until after the lifespan shutdown.
+        """
+        self.loop = asyncio.get_running_loop()
+        # Only the main thread can set signal handlers (uvicorn doesn't set any either when it runs elsewhere)
+        if self.drain_seconds <= 0 or threading.current_thread() is not threading.main_thread():
+            return
+        for sig in HANDLED_SIGNALS:
+            previous = signal.getsignal(sig)
+            if callable(previous):
+                self.previous_handlers[sig] = previous
+                signal.signal(sig, self.handle_exit)
+
+    def stop(self) -> None:
+        """Puts back the handlers start replaced, call it at lifespan shutdown."""
+        for sig, previous in self.previous_handlers.items():
+            signal.signal(sig, previous)
+        self.previous_handlers = {}
+
+    def handle_exit(self, sig, frame) -> None:
+        previous = self.previous_handlers[sig]
+        if self.draining:
+            # Second signal, stop waiting for the drain
+            previous(sig, frame)
+            return
+        self.draining = True
+        # Signal handlers run between any two bytecodes, so leave the actual work to the loop
+        self.loop.call_soon_threadsafe(self.start_drain, previous, sig, frame)
+
+    def start_drain(self, exit_handler, sig, frame) -> None:
+        self.drain_task = asyncio.create_task(self.drain_then_exit(exit_handler, sig, frame))
+
+    async def drain_then_exit(self, exit_handler, sig, frame) -> None:
+        try:
+            await self.drain()
+        except Exception:
+            logger.exception("drain_failed")
+        exit_handler(sig, frame)
+
+    async def drain(self) -> None:
+        self.draining = True
+        subscriptions = [(room.hub, subscription) for room in self.rooms.rooms.values()
+                         for subscription in room.hub.subscriptions]
+        random.shuffle(subscriptions)
+        batch_count = max(1, int(self.drain_seconds / DRAIN_BATCH_INTERVAL_SECONDS))
+        batch_size = max(1, math.ceil(len(subscriptions) / batch_count))
+        logger.info("drain_started", extra={"connections": len(subscriptions), "batch_size": batch_size})
+        for batch_start in range(0, len(subscriptions), batch_size):
+            for hub, subscription in subscriptions[batch_start:batch_start + batch_size]:
+                hub.unsubscribe(subscription, retry_millis=jittered_retry_millis())
+            await asyncio.sleep(DRAIN_BATCH_INTERVAL_SECONDS)
+        logger.info("drain_finished", extra={"connections": len(subscriptions)})
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import aclosing
+
+from zibbit import ZibbitGame
+from snapshot_cache import SnapshotCache
+from metrics import SSE_DROPPED, EVENTS_DISPATCHED
+
+# Max number of events buffered per connected client before it's considered too slow and dropped
+SUBSCRIBER_QUEUE_MAX_SIZE = 256
+# Seconds to wait before re-subscribing after the Redis subscriber connection fails
+RESUBSCRIBE_BACKOFF_SECONDS = 1
+# Events that are coalesced when batching is enabled: event type -> (batched event type, id field)
+COALESCED_EVENT_TYPES = {
+    b"candidate_vote": (b"candidate_votes", "candidate_id"),
+    b"word_flag": (b"word_flags", "word_id"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def encode_event_frame(event_type: bytes, data: bytes, server_time: float, event_id: bytes | None = None) -> bytes:
+    """
+    Builds the final SSE frame for an event. `data` is the JSON object exactly as it was published,
+    so the server timestamp is spliced in as the first key instead of decoding and re-encoding it.
+    """
+    body = data.lstrip()[1:].lstrip()
+    separator = b"" if body.startswith(b"}") else b", "
+    return b"".join((
+        b"id: " + event_id + b"\r\n" if event_id else b"",
+        b"event: ", event_type, b"\r\n",
+        b"data: {\"server_time\": ", repr(server_time).encode(), separator, body, b"\r\n\r\n"
+    ))
+
+
+class Subscription:
+    """
+    A single client's view of the event stream. Events are buffered in a bounded queue;
+    when the queue overflows the subscription is closed instead of blocking the hub.
+    """
+
+    def __init__(self, max_size: int = SUBSCRIBER_QUEUE_MAX_SIZE):
+        # Holds (seq, frame, time the event was published) tuples
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.closed = False
+        # Reconnect delay (ms) to hand the client when it's closed on purpose (ex. drained for a deploy)
+        self.retry_millis = None
+
+    def push(self, item) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def close(self, retry_millis: int | None = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.retry_millis = retry_millis
+        # Throw away whatever is still buffered, and wake the reader up with the end-of-stream marker
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self):
+        """Returns the next (seq, frame, publish time) tuple, or None once the subscription has been closed."""
+        return await self.queue.get()
+
+
+class EventHub:
+    """
+    Per-worker fan-out of game events. A single Redis subscription is read by one task,
+    each message is encoded into its SSE frame once, and the same bytes are handed to
+    every connected client's bounded queue. Events are also applied to the worker's snapshot cache.
+
+    With a broadcast tick set, vote and flag events are held back and only the latest state per
+    candidate / word is sent once per tick, as a single batched event.
+    """
+
+    def __init__(self, game: ZibbitGame, queue_max_size: int = SUBSCRIBER_QUEUE_MAX_SIZE,
+                 broadcast_tick_seconds: float = 0):
+        self.game = game
+        self.queue_max_size = queue_max_size
+        self.subscriptions: set[Subscription] = set()
+        self.snapshot_cache = SnapshotCache(game)
+        self.broadcast_tick_seconds = broadcast_tick_seconds
+        # Batched event type -> {id: latest payload}, plus the seq and event log id of the newest held back event
+        # and the publish time of the oldest one
+        self.pending_updates: dict[bytes, dict] = {}
+        self.pending_seq = 0
+        self.pending_event_id = None
+        self.pending_published_at = None
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_max_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription, retry_millis: int | None = None) -> None:
+        self.subscriptions.discard(subscription)
+        subscription.close(retry_millis)
+
+    def broadcast(self, item) -> None:
+        slow_subscriptions = [sub for sub in self.subscriptions if not sub.push(item)]
+        for subscription in slow_subscriptions:
+            # The client can't keep up; cut it loose so it reconnects and catches up from scratch
+            SSE_DROPPED.labels(self.game.room_id).inc()
+            logger.info("slow_subscriber_dropped", extra={"room": self.game.room_id})
+            self.unsubscribe(subscription)
+
+    def dispatch(self, event_type: bytes, data: bytes, event_id: bytes | None = None,
+                 published_at: float | None = None) -> None:
+        EVENTS_DISPATCHED.labels(event_type.decode()).inc()
+        payload = json.loads(data)
+        self.snapshot_cache.apply_event(event_type.decode(), payload, event_id)
+        now = time.time()
+        # Events without a publish time are measured from here instead
+        published_at = published_at or now
+        if self.broadcast_tick_seconds and event_type in COALESCED_EVENT_TYPES:
+            batched_event_type, id_field = COALESCED_EVENT_TYPES[event_type]
+            self.pending_updates.setdefault(batched_event_type, {})[payload[id_field]] = payload
+            self.pending_seq = payload["seq"]
+            self.pending_event_id = event_id
+            if self.pending_published_at is None:
+                self.pending_published_at = published_at
+            return
+        # Anything held back happened before this event, so it goes out first to keep the order
+        self.flush_pending_updates()
+        self.broadcast((payload["seq"], encode_event_frame(event_type, data, now, event_id), published_at))
+
+    def flush_pending_updates(self) -> None:
+        if not self.pending_updates:
+            return
+        pending_updates, self.pending_updates = self.pending_updates, {}
+        # A batch is as late as the oldest update it holds
+        published_at, self.pending_published_at = self.pending_published_at, None
+        now = time.time()
+        for batched_event_type, updates in pending_updates.items():
+            # Every batch carries the newest seq, clients only skip it if they've already seen all of it
+            data = json.dumps({"seq": self.pending_seq, "updates": [*updates.values()]}).encode()
+            frame = encode_event_frame(batched_event_type, data, now, self.pending_event_id)
+            self.broadcast((self.pending_seq, frame, published_at))
+
+    def drop_all(self) -> None:
+        for subscription in list(self.subscriptions):
+            self.unsubscribe(subscription)
+
+    async def run(self) -> None:
+        flush_task = asyncio.create_task(self.run_broadcast_ticker()) if self.broadcast_tick_seconds else None
+        try:
+            if self.game.event_log:
+                await self.run_event_log_reader()
+            else:
+                await self.run_pubsub_reader()
+        finally:
+            if flush_task:
+                flush_task.cancel()
+
+    async def run_broadcast_ticker(self) -> None:
+        while True:
+            await asyncio.sleep(self.broadcast_tick_seconds)
+            self.flush_pending_updates()
+
+    async def run_pubsub_reader(self) -> None:
+        while True:
+            try:
+                async with aclosing(self.game.store.listen_events()) as events:
+                    async for event_type, data, published_at in events:
+                        self.dispatch(event_type, data, published_at=published_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("subscriber_connection_failed", extra={"room": self.game.room_id})
+                # Anything published while we were disconnected is lost, so make every client resync
+                self.snapshot_cache.invalidate()
+                self.pending_updates = {}
+                self.pending_published_at = None
+                self.drop_all()
+                await asyncio.sleep(RESUBSCRIBE_BACKOFF_SECONDS)
+
+    async def run_event_log_reader(self) -> None:
+        last_event_id = None
+        while True:
+            try:
+                if last_event_id is None:
+                    # Only events logged from here on are live, anything older is served by replay
+                    last_event_id = await self.game.get_latest_event_id()
+                for event_id, event_type, data, published_at in await self.game.read_event_log(last_event_id):
+                    last_event_id = event_id.decode()
+                    self.dispatch(event_type, data, event_id, published_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The log still has everything after `last_event_id`, so just pick up where we left off
+                logger.exception("event_log_read_failed", extra={"room": self.game.room_id})
+                await asyncio.sleep(RESUBSCRIBE_BACKOFF_SECONDS)
@@ -0,0 +1,178 @@
+import os
+import re
+import socket
+import uuid
+
+# Room used by clients that don't ask for a specific one
+DEFAULT_ROOM_ID = "default"
+# Room ids are part of every key and channel name, so they're kept to a safe charset
+ROOM_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+# Game status field of the game phase (ex. COOLDOWN or IN_PLAY)
+GAME_STATUS_KEY = "game_status"
+# Fields of the game phase, in the order stores return them
+GAME_PHASE_FIELDS = (GAME_STATUS_KEY, "game_start_utc_time", "game_end_utc_time", "next_game_start_utc_time")
+
+# Types of the game events published by the stores
+EVENT_GAME_START_CHANNEL = "game_start"
+EVENT_GAME_END_CHANNEL = "game_end"
+EVENT_WORDS_APPENDED_CHANNEL = "words_appended"
+EVENT_WORD_REMOVED_CHANNEL = "word_removed"
+EVENT_CANDIDATE_UPDATE_CHANNEL = "candidate_update"
+EVENT_CANDIDATE_VOTE_CHANNEL = "candidate_vote"
+EVENT_CANDIDATE_EXPIRED_CHANNEL = "candidate_expired"
+EVENT_WORD_FLAG_CHANNEL = "word_flag"
+EVENT_USER_COUNT = "user_count"
+
+
+def validate_room_id(room_id: str) -> None:
+    if not ROOM_ID_PATTERN.fullmatch(room_id):
+        raise ValueError(f"bad room id: {room_id}")
+
+
+def new_worker_id() -> str:
+    """Id that's unique to this worker across every host, ex. "web-1:42:3f03998a"."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class GameStore:
+    """
+    Storage and event bus of a single room. Every method that changes the game is atomic and publishes
+    the events it causes itself, each stamped with the room's next sequence number ("seq" as the first key
+    of the JSON payload). Game rules that don't need atomicity (timings, thresholds, validation) stay in
+    ZibbitGame and are passed in.
+
+    Engines: RedisGameStore (shared by any number of workers) and MemoryGameStore (single process).
+    """
+
+    room_id: str
+    # When enabled, events are kept in a capped log so clients can resume from the last event they saw
+    event_log: bool
+    # Whether other workers can be running the store's rooms too. When they can't, a room that isn't running
+    # on this worker doesn't exist, and requests for it are turned away rather than creating it.
+    shared_across_workers = True
+
+    def for_room(self, room_id: str) -> "GameStore":
+        """Returns the store of another room, sharing this store's connections (or memory)."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Closes the connections shared with every store for_room handed out, once no room needs them."""
+        pass
+
+    async def drop_room(self) -> None:
+        """Called once this worker stops running the room, forgets its state if nobody else can have it."""
+        pass
+
+    # Presence
+
+    async def heartbeat_presence(self, worker_id: str, connections: int, now: float, ttl_seconds: float) -> None:
+        """Records the worker's number of open connections to the room, counted until `now` + `ttl_seconds`."""
+        raise NotImplementedError
+
+    async def broadcast_presence(self, token: str, now: float) -> int | None:
+        """
+        Sums the connections of the workers whose heartbeat hasn't run out and publishes the total as a
+        user_count event if it changed since the last one, unless `token` no longer holds the lease.
+        Returns the total, None if there's no lease.
+        """
+        raise NotImplementedError
+
+    # Game timer
+
+    async def acquire_timer_lease(self, token: str, lease_seconds: float) -> bool:
+        """Acquires the timer leader lease if nobody holds it, or extends it if `token` already does."""
+        raise NotImplementedError
+
+    async def release_timer_lease(self, token: str) -> None:
+        raise NotImplementedError
+
+    async def get_game_phase(self) -> list:
+        """Returns the GAME_PHASE_FIELDS values as strings, missing values as None."""
+        raise NotImplementedError
+
+    async def set_game_phase(self, token: str, event_type: str, game_phase: dict) -> bool:
+        """Replaces the phase and publishes it as `event_type`, unless `token` no longer holds the lease."""
+        raise NotImplementedError
+
+    async def start_game(self, token: str, event_type: str, game_phase: dict) -> bool:
+        """
+        Clears the previous game like clear_game and moves into the new phase like set_game_phase, in one step
+        and only if `token` still holds the lease.
+        """
+        raise NotImplementedError
+
+    async def expire_candidates(self, token: str, now: float) -> float | None:
+        """
+        Retires the candidates expired by `now` with a candidate_expired event each, unless `token` no longer
+        holds the lease. Returns the next candidate expiration, None if there's none (or no lease).
+        """
+        raise NotImplementedError
+
+    async def clear_game(self) -> None:
+        """Drops the story, candidates and phrase cooldowns, and resets the ids."""
+        raise NotImplementedError
+
+    # Game actions
+
+    async def hit_rate_limit(self, action: str, client_ip: str, limit: int, window_seconds: float, now: float) -> float:
+        """Records a request in the client's sliding window, returns 0 if it's allowed or the seconds to wait."""
+        raise NotImplementedError
+
+    async def submit_candidate(self, phrase: str, client_ip: str, now: float, decay_seconds: int,
+                               cooldown_seconds: int) -> int | None:
+        """Creates a candidate, returns its id or None if the phrase is still in its submission cooldown."""
+        raise NotImplementedError
+
+    async def vote(self, candidate_id: int, client_ip: str, now: float, vote_threshold: int,
+                   cooldown_seconds: int) -> int | None:
+        """
+        Toggles the client's vote, extending the candidate's life by its vote count on a new vote and moving
+        it into the story at the threshold. Returns None if the vote isn't allowed, 1 if counted, 2 if promoted.
+        """
+        raise NotImplementedError
+
+    async def flag_word(self, word_id: int, client_ip: str, flag_threshold: int) -> int | None:
+        """Toggles the client's flag. Returns None if the word isn't in the story, 1 if toggled, 2 if removed."""
+        raise NotImplementedError
+
+    # Reads
+
+    async def read_game_state(self) -> list:
+        """
+        Returns [seq, last event log id, game phase, story version, story words, candidates, user count]
+        as of one instant, where story words are [(word_id, word, creator, flags), ...], candidates are
+        [(candidate_id, phrase, creator, expiration_utc_time, votes), ...] and the user count is the last
+        one published.
+        """
+        raise NotImplementedError
+
+    async def read_story(self) -> list:
+        """Returns [story version, story words] as of one instant."""
+        raise NotImplementedError
+
+    # Event bus
+
+    def listen_events(self):
+        """
+        Async iterator of (event_type, data, published_at) for every event published from now on, the first two
+        as raw bytes and the last one as the store's clock when the event was published.
+        """
+        raise NotImplementedError
+
+    async def read_event_log(self, last_event_id: str, block_millis: int) -> list:
+        """
+        Blocks until events newer than `last_event_id` are logged, returns [(id, event_type, data, published_at), ...]
+        with the same types as listen_events (`published_at` can be None for events logged before it was recorded).
+        """
+        raise NotImplementedError
+
+    async def get_latest_event_id(self) -> str:
+        raise NotImplementedError
+
+    async def get_events_since(self, last_event_id: str):
+        """
+        Returns (seq of `last_event_id`, [(id, event_type, data, seq), ...] for every event logged after it),
+        or None when the log no longer has `last_event_id` and the caller needs a full snapshot.
+        """
+        raise NotImplementedError
@@ -1,33 +1,94 @@
-from datetime import datetime
 import json
+import logging
+import math
 import os
+import time
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, aclosing
 
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sse_starlette.sse import EventSourceResponse, ServerSentEvent
-from zibbit import ZibbitGame, GAME_EVENTS_CHANNEL_PREFIX
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.requests import HTTPConnection
+from sse_starlette.sse import EventSourceResponse
+from zibbit import ZibbitGame, DEFAULT_ROOM_ID, ROOM_ID_PATTERN
+from memory_store import MemoryGameStore
+from event_hub import EventHub, encode_event_frame
+from rooms import RoomRegistry, Room
+from rate_limiter import RateLimiter, DEFAULT_RATE_LIMITS, parse_rate_limit
+from metrics import (REGISTRY, RouteMetricsMiddleware, SSE_CONNECTIONS, SSE_QUEUE_DEPTH, FANOUT_LAG,
+                     WS_CONNECTIONS, WS_ACTION_LATENCY, CONNECTIONS_SHED)
+from structured_logging import configure_logging
+from story_archive import StoryArchive
+from connection_drain import ConnectionDrainer, encode_retry_frame, jittered_retry_millis
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
 REDIS_USERNAME = os.getenv('REDIS_USERNAME', 'user')
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', 'pass')
+EVENT_LOG_ENABLED = os.getenv('EVENT_LOG_ENABLED', 'false').lower() == 'true'
+# "redis", or "memory" to keep the game in this process (a single worker, no Redis needed)
+STORAGE_ENGINE = os.getenv('STORAGE_ENGINE', 'redis').lower()
+# When above 0, vote and flag events are coalesced and broadcast in batches every this many milliseconds
+EVENT_BATCH_MILLIS = int(os.getenv('EVENT_BATCH_MILLIS', '0'))
+# Rooms started as soon as the app is up (any other valid room id is started on its first request)
+ROOM_IDS = [room_id.strip() for room_id in os.getenv('ROOM_IDS', DEFAULT_ROOM_ID).split(',') if room_id.strip()]
+# Per-client limits of each action as "<max requests>/<window seconds>" (ex. RATE_LIMIT_VOTE=30/10), "0" turns one off
+RATE_LIMITS = {
+    action: parse_rate_limit(os.getenv(f'RATE_LIMIT_{action.upper()}', f'{limit}/{window_seconds}'))
+    for action, (limit, window_seconds) in DEFAULT_RATE_LIMITS.items()
+}
+# Set to false to refuse /ws connections, clients then stay on SSE and POST requests
+WEBSOCKETS_ENABLED = os.getenv('WEBSOCKETS_ENABLED', 'true').lower() == 'true'
+# Seconds between keepalive comments on idle SSE streams, so proxies don't time them out
+SSE_KEEPALIVE_SECONDS = 15
+# Seconds over which open streams are closed on shutdown, 0 closes them all at once (keep it under the stop timeout)
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '8'))
+# Max number of new connections building their starting state (snapshot rebuild or event log replay) at once
+SNAPSHOT_BUILD_MAX_CONCURRENCY = int(os.getenv('SNAPSHOT_BUILD_MAX_CONCURRENCY', '16'))
+# Seconds a new connection waits for a build slot before it's told to come back later
+SNAPSHOT_BUILD_ADMISSION_TIMEOUT_SECONDS = 5
+
+# Directory finished stories are archived in, an empty value turns the archive off
+STORY_ARCHIVE_DIR = os.getenv('STORY_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'story_archive'))
+# Max number of stories returned per page of /stories
+STORIES_PAGE_MAX_SIZE = 50
 
 APP_HOST = os.getenv('APP_HOST', '0.0.0.0')
 APP_PORT = int(os.getenv('APP_PORT', '8000'))
-zg = ZibbitGame(redis_host=REDIS_HOST, redis_port=REDIS_PORT, redis_user=REDIS_USERNAME, redis_pass=REDIS_PASSWORD)
+APP_WORKERS = int(os.getenv('APP_WORKERS', '1'))
+# Reload on code changes, for local development only
+APP_RELOAD = os.getenv('APP_RELOAD', 'false').lower() == 'true'
+# DEBUG logs every request, WARNING keeps logging out of the way under load
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# "text" (key=value) or "json" log lines
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+archive = StoryArchive(STORY_ARCHIVE_DIR) if STORY_ARCHIVE_DIR else None
+if STORAGE_ENGINE == 'memory':
+    zg = ZibbitGame(store=MemoryGameStore(event_log=EVENT_LOG_ENABLED), archive=archive)
+else:
+    zg = ZibbitGame(redis_host=REDIS_HOST, redis_port=REDIS_PORT, redis_user=REDIS_USERNAME, redis_pass=REDIS_PASSWORD, event_log=EVENT_LOG_ENABLED, archive=archive)
+rooms = RoomRegistry(zg, broadcast_tick_seconds=EVENT_BATCH_MILLIS / 1000, pinned_room_ids=ROOM_IDS)
+rate_limiter = RateLimiter(RATE_LIMITS)
+drainer = ConnectionDrainer(rooms, SHUTDOWN_DRAIN_SECONDS)
+snapshot_build_admission = asyncio.Semaphore(SNAPSHOT_BUILD_MAX_CONCURRENCY)
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Starting up FastAPI app...")
-    asyncio.create_task(zg.timer_loop())
+    logger.info("app_starting", extra={"storage_engine": STORAGE_ENGINE, "rooms": ",".join(ROOM_IDS)})
+    rooms.start()
+    drainer.start()
     yield
-    print("Shutting down FastAPI app...")
+    logger.info("app_stopping")
+    drainer.stop()
+    await rooms.stop_all()
 
 app = FastAPI(
     title="Zibbit!",
@@ -40,95 +101,343 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RouteMetricsMiddleware)
 
 
-def get_client_ip(req: Request):
-    client_ip = req.client.host
-    forwarded_for = req.headers.get("x-forwarded-for")
-    print(f"host=({client_ip})/x-forward-for=({forwarded_for})")
-    return forwarded_for or client_ip
+def get_client_ip(req: HTTPConnection):
+    return req.headers.get("x-forwarded-for") or req.client.host
 
 
-@app.get('/events')
-async def sse_events(request: Request):
-    client_ip = get_client_ip(request)
-    await zg.register_user(client_ip)
+def shed_connection(room_id: str, reason: str) -> bytes:
+    """Counts a connection turned away, returns the `retry:` frame sending it back after a random delay."""
+    CONNECTIONS_SHED.labels(reason).inc()
+    logger.debug("connection_shed", extra={"room": room_id, "reason": reason})
+    return encode_retry_frame(jittered_retry_millis())
+
+
+def get_room(room_id: str) -> Room:
+    room = rooms.get(room_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail=f'Unknown room: {room_id}')
+    return room
+
+
+def get_game(room_id: str) -> ZibbitGame:
+    # Unlike get_room, doesn't start the room on this worker: a request doesn't keep it running
+    zg = rooms.get_game(room_id)
+    if zg is None:
+        raise HTTPException(status_code=404, detail=f'Unknown room: {room_id}')
+    return zg
+
+
+async def enforce_rate_limit(zg: ZibbitGame, action: str, client_ip: str) -> None:
+    retry_after = await rate_limiter.check(zg, action, client_ip)
+    if retry_after:
+        retry_after_seconds = math.ceil(retry_after)
+        raise HTTPException(
+            status_code=429,
+            detail=f'Too many requests, retry in {retry_after_seconds}s',
+            headers={"Retry-After": str(retry_after_seconds)})
+
+
+async def catch_up_frames(zg: ZibbitGame, hub: EventHub, last_event_id: str | None) -> tuple[int, list[bytes]] | None:
+    """
+    Frames a new connection starts with: the events it missed since `last_event_id` when the event log can
+    replay them, otherwise the cached snapshot. Also returns the seq they cover, the hub's older events are skipped.
+
+    Replays and snapshot rebuilds read the store, so only SNAPSHOT_BUILD_MAX_CONCURRENCY of them run at once.
+    Returns None when no slot frees up in time, the client should then come back later.
+    """
+    replaying = bool(zg.event_log and last_event_id)
+    if not replaying and hub.snapshot_cache.state is not None:
+        # A cached snapshot costs nothing to hand out
+        return await build_catch_up_frames(zg, hub, None)
+    try:
+        await asyncio.wait_for(snapshot_build_admission.acquire(), SNAPSHOT_BUILD_ADMISSION_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return None
+    try:
+        return await build_catch_up_frames(zg, hub, last_event_id)
+    finally:
+        snapshot_build_admission.release()
+
+
+async def build_catch_up_frames(zg: ZibbitGame, hub: EventHub, last_event_id: str | None) -> tuple[int, list[bytes]]:
+    resumed = None
+    if zg.event_log and last_event_id:
+        resumed = await zg.get_events_since(last_event_id)
+
+    if resumed is not None:
+        # Resuming client: only send what it missed while it was away
+        replayed_up_to, missed_events = resumed
+        now = time.time()
+        frames = []
+        for event_id, event_type, data, seq in missed_events:
+            replayed_up_to = seq
+            frames.append(encode_event_frame(event_type, data, now, event_id))
+        return replayed_up_to, frames
+    # Give the client the live game state from this worker's cached snapshot
+    snapshot_seq, snapshot_event_id, snapshot = await hub.snapshot_cache.get()
+    return snapshot_seq, [encode_event_frame(b"game_state", snapshot, time.time(), snapshot_event_id)]
+
+
+class EventStream:
+    """
+    The events of one client connection, whichever transport carries them (`transport` is "sse" or "ws"):
+    the catch-up frames, then every frame from the hub the client hasn't seen yet. Once `frames` is done,
+    `end_reason` says why the server ended it: "draining", "busy" or "dropped" (None if the client left).
+    """
 
-    pubsub = zg.pubsub()
-    await pubsub.psubscribe(f"{GAME_EVENTS_CHANNEL_PREFIX}:*")
+    def __init__(self, room: Room, client_ip: str, transport: str):
+        self.zg, self.hub = room.game, room.hub
+        self.client_ip = client_ip
+        self.transport = transport
+        self.connections = (SSE_CONNECTIONS if transport == "sse" else WS_CONNECTIONS).labels(self.zg.room_id)
+        self.end_reason = None
 
-    async def event_generator():
+    async def frames(self, last_event_id: str | None):
+        if drainer.draining:
+            # This worker is going away, send the client to the next one
+            self.end_reason = "draining"
+            yield shed_connection(self.zg.room_id, "draining")
+            return
+        # Subscribe before building the snapshot so nothing published in between is missed
+        subscription = self.hub.subscribe()
+        queue_depth, fanout_lag = SSE_QUEUE_DEPTH.labels(), FANOUT_LAG.labels()
+        log_extra = {"room": self.zg.room_id, "client_ip": self.client_ip}
+        self.connections.inc()
         try:
-            print(f"[CONNECT] {client_ip} connected")
-            # Give the client the live game state
-            initial_game_state = await zg.get_game_state()
-            yield ServerSentEvent(event="game_state", data=json.dumps({
-                "server_time": datetime.now().timestamp(),
-                **initial_game_state
-            }))
+            logger.debug(f"{self.transport}_connected", extra=log_extra)
+            caught_up = await catch_up_frames(self.zg, self.hub, last_event_id)
+            if caught_up is None:
+                self.end_reason = "busy"
+                yield shed_connection(self.zg.room_id, "busy")
+                return
+            # Sequence number of the last event already sent (or replayed), anything newer comes from the hub
+            replayed_up_to, frames = caught_up
+            for frame in frames:
+                yield frame
 
             while True:
-                # Timeout every 5 seconds so we can check if client disconnected
-                try:
-                    message = await asyncio.wait_for(pubsub.get_message(ignore_subscribe_messages=True), timeout=5)
-                except asyncio.TimeoutError:
-                    message = None
-
-                if await request.is_disconnected():
-                    print("hit disconnect")
-                    break
-                if message:
-                    event_type = message["channel"].split(":")[-1]
-                    yield ServerSentEvent(event=event_type, data=json.dumps({
-                        "server_time": datetime.now().timestamp(),
-                        **json.loads(message['data'])
-                    }))
+                item = await subscription.get()
+                if item is None:
+                    if subscription.retry_millis:
+                        # Drained: tell the client when to reconnect before closing
+                        self.end_reason = "draining"
+                        yield encode_retry_frame(subscription.retry_millis)
+                    else:
+                        # The hub closed our subscription (we fell too far behind), so let the client reconnect
+                        self.end_reason = "dropped"
+                        logger.debug(f"{self.transport}_dropped", extra=log_extra)
+                    return
+                seq, frame, published_at = item
+                if seq <= replayed_up_to:
+                    # Already part of the snapshot or the replay
+                    continue
+                queue_depth.observe(subscription.queue.qsize())
+                fanout_lag.observe(time.time() - published_at)
+                # Already-encoded SSE frame shared by every client on this worker
+                yield frame
         finally:
-            print("entered finally")
-            asyncio.create_task(zg.deregister_user(client_ip))
-            await pubsub.punsubscribe(f"{GAME_EVENTS_CHANNEL_PREFIX}:*")
-            await pubsub.close()
+            self.connections.dec()
+            logger.debug(f"{self.transport}_disconnected", extra=log_extra)
+            self.hub.unsubscribe(subscription)
 
-    return EventSourceResponse(event_generator())
+
+# The routes without a room prefix serve the default room (or the one in the `room_id` query parameter)
+@app.get('/events')
+@app.get('/rooms/{room_id}/events')
+async def sse_events(request: Request, room_id: str = DEFAULT_ROOM_ID):
+    stream = EventStream(get_room(room_id), get_client_ip(request), "sse")
+    # No need to poll for disconnects: sse-starlette cancels the stream as soon as the client goes away
+    return EventSourceResponse(stream.frames(request.headers.get("last-event-id")), ping=SSE_KEEPALIVE_SECONDS)
+
+@app.get('/story')
+@app.get('/rooms/{room_id}/story')
+async def get_story(room_id: str = DEFAULT_ROOM_ID):
+    zg = get_game(room_id)
+    # Lets clients resync the story when they notice a gap in the story versions
+    return JSONResponse(status_code=200, content=await zg.get_story())
 
 @app.post('/submit_candidate')
-async def submit_candidate(request: Request):
+@app.post('/rooms/{room_id}/submit_candidate')
+async def submit_candidate(request: Request, room_id: str = DEFAULT_ROOM_ID):
+    zg = get_game(room_id)
     client_ip = get_client_ip(request)
-    print(f"{client_ip} -> /submit_candidate")
+    logger.debug("submit_candidate", extra={"room": zg.room_id, "client_ip": client_ip})
+    await enforce_rate_limit(zg, "submit_candidate", client_ip)
     request_data = await request.json()
     phrase = request_data["phrase"]
     if await zg.handle_phrase_submission(client_ip, phrase):
-        print("successful submit_candidate")
         return JSONResponse(status_code=200, content='Success')
     else:
-        print("failed submit_candidate")
         return JSONResponse(status_code=400, content=f'Unable to submit candidate: {phrase}')
 
 @app.post('/vote')
-async def vote(request: Request):
+@app.post('/rooms/{room_id}/vote')
+async def vote(request: Request, room_id: str = DEFAULT_ROOM_ID):
+    zg = get_game(room_id)
     client_ip = get_client_ip(request)
-    print(f"{client_ip} -> /vote")
+    logger.debug("vote", extra={"room": zg.room_id, "client_ip": client_ip})
+    await enforce_rate_limit(zg, "vote", client_ip)
     request_data = await request.json()
     candidate_id = request_data["candidate_id"]
     if not candidate_id:
         return 'Empty', 400
+    try:
+        candidate_id = int(candidate_id)
+    except (TypeError, ValueError):
+        return JSONResponse(status_code=400, content=f'Unable to submit vote: {candidate_id}')
     if await zg.handle_vote(client_ip, candidate_id):
         return JSONResponse(status_code=200, content='Success')
     else:
         return JSONResponse(status_code=400, content=f'Unable to submit vote: {candidate_id}')
 
 @app.post('/flag_word')
-async def submit_word_flag(request: Request):
+@app.post('/rooms/{room_id}/flag_word')
+async def submit_word_flag(request: Request, room_id: str = DEFAULT_ROOM_ID):
+    zg = get_game(room_id)
     client_ip = get_client_ip(request)
-    print(f"{client_ip} -> /flag_word")
+    logger.debug("flag_word", extra={"room": zg.room_id, "client_ip": client_ip})
+    await enforce_rate_limit(zg, "flag_word", client_ip)
     request_data = await request.json()
-    word_id = int(request_data["word_id"])
+    try:
+        word_id = int(request_data["word_id"])
+    except (TypeError, ValueError):
+        return JSONResponse(status_code=400, content=f'Unable to submit flag: {request_data["word_id"]}')
     if await zg.handle_word_flag(client_ip, word_id):
         return JSONResponse(status_code=200, content='Success')
     else:
         return JSONResponse(status_code=400, content=f'Unable to submit flag: {word_id}')
 
 
+# Close code of a WebSocket whose event stream the server ended, by EventStream.end_reason
+WEBSOCKET_CLOSE_CODES = {
+    "draining": status.WS_1012_SERVICE_RESTART,
+    "busy": status.WS_1013_TRY_AGAIN_LATER,
+    "dropped": status.WS_1013_TRY_AGAIN_LATER,
+}
+
+# Actions accepted on the WebSocket: action -> (the message field it acts on, that field's type, its ZibbitGame
+# handler, called with (game, client ip, field value))
+WEBSOCKET_ACTIONS = {
+    "submit_candidate": ("phrase", str, ZibbitGame.handle_phrase_submission),
+    "vote": ("candidate_id", int, ZibbitGame.handle_vote),
+    "flag_word": ("word_id", int, ZibbitGame.handle_word_flag),
+}
+
+
+async def run_websocket_action(zg: ZibbitGame, client_ip: str, message: dict) -> dict:
+    """Runs an action sent on the WebSocket, returns its ack (`status` matches what the POST route would answer)."""
+    action = message.get("action")
+    ack = {"ack": message.get("id")}
+    if action not in WEBSOCKET_ACTIONS:
+        return {**ack, "ok": False, "status": 400, "error": f'Unknown action: {action}'}
+    field, field_type, handler = WEBSOCKET_ACTIONS[action]
+    value = message.get(field)
+    # Checked here so a bad value gets its ack instead of failing in the handler (JSON true is an int to Python)
+    if not isinstance(value, field_type) or isinstance(value, bool):
+        return {**ack, "ok": False, "status": 400, "error": f'Malformed {action}'}
+    try:
+        await enforce_rate_limit(zg, action, client_ip)
+        if await handler(zg, client_ip, value):
+            return {**ack, "ok": True, "status": 200}
+        return {**ack, "ok": False, "status": 400, "error": f'Unable to {action}'}
+    except HTTPException as e:
+        return {**ack, "ok": False, "status": e.status_code, "error": e.detail,
+                "retry_after": int(e.headers["Retry-After"])}
+    except ValueError:
+        # The game turned the phrase down (ex. too many words)
+        return {**ack, "ok": False, "status": 400, "error": f'Malformed {action}'}
+
+
+@app.websocket('/ws')
+@app.websocket('/rooms/{room_id}/ws')
+async def websocket_session(websocket: WebSocket, room_id: str = DEFAULT_ROOM_ID, last_event_id: str | None = None):
+    """
+    Game events and player actions on a single connection. Events are sent as binary messages holding the
+    same SSE frames as /events. Actions are JSON text messages, ex. {"id": 1, "action": "vote", "candidate_id": 4},
+    each answered with a JSON text ack, ex. {"ack": 1, "ok": true, "status": 200}.
+    """
+    room = rooms.get(room_id) if WEBSOCKETS_ENABLED else None
+    if room is None:
+        # Refused during the handshake, so clients fall back to SSE
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    zg = room.game
+    client_ip = get_client_ip(websocket)
+    await websocket.accept()
+    stream = EventStream(room, client_ip, "ws")
+
+    async def send_events():
+        # The client reads the same frames as SSE clients, `retry:` ones included
+        async with aclosing(stream.frames(last_event_id)) as frames:
+            async for frame in frames:
+                await websocket.send_bytes(frame)
+        if stream.end_reason:
+            await websocket.close(code=WEBSOCKET_CLOSE_CODES[stream.end_reason])
+
+    async def receive_actions():
+        while True:
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                return
+            start = time.perf_counter()
+            try:
+                message = json.loads(received.get("text") or "")
+            except ValueError:
+                message = None
+            if isinstance(message, dict):
+                ack = await run_websocket_action(zg, client_ip, message)
+            else:
+                ack = {"ack": None, "ok": False, "status": 400, "error": 'Expected a JSON object'}
+            await websocket.send_text(json.dumps(ack))
+            action = message.get("action") if isinstance(message, dict) else None
+            # Anything that isn't a known action shares one label, so clients can't grow the metric
+            action_label = action if action in WEBSOCKET_ACTIONS else "other"
+            WS_ACTION_LATENCY.labels(action_label, str(ack["status"])).observe(time.perf_counter() - start)
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_actions())]
+    try:
+        # Whichever side stops first (client gone, or dropped by the hub) ends the session
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning("ws_failed", exc_info=task.exception(), extra={"room": zg.room_id})
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Past stories come from the on-disk archive only, so they don't need the room to be running (or Redis)
+@app.get('/stories')
+@app.get('/rooms/{room_id}/stories')
+async def get_stories(room_id: str = DEFAULT_ROOM_ID, before: int | None = None, limit: int = 10):
+    """Finished stories, newest first. Pass the returned `next_before` as `before` to get the next page."""
+    if archive is None or not ROOM_ID_PATTERN.fullmatch(room_id):
+        raise HTTPException(status_code=404, detail=f'No stories for room: {room_id}')
+    limit = max(1, min(limit, STORIES_PAGE_MAX_SIZE))
+    stories, next_before = await asyncio.to_thread(archive.read_page, room_id, before, limit)
+    return JSONResponse(status_code=200, content={"stories": stories, "next_before": next_before})
+
+@app.get('/stories/{story_id}')
+@app.get('/rooms/{room_id}/stories/{story_id}')
+async def get_archived_story(story_id: int, room_id: str = DEFAULT_ROOM_ID):
+    story = None
+    if archive is not None and ROOM_ID_PATTERN.fullmatch(room_id):
+        story = await asyncio.to_thread(archive.read, room_id, story_id)
+    if story is None:
+        raise HTTPException(status_code=404, detail=f'Unknown story: {story_id}')
+    return JSONResponse(status_code=200, content=story)
+
+
+@app.get('/metrics')
+async def metrics():
+    # This worker's numbers only, see metrics.py
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
 
 
@@ -137,6 +446,11 @@ if __name__ == "__main__":
         "main:app",
         host=APP_HOST,
         port=APP_PORT,
-        log_level="debug",
-        reload=True,
+        log_level=LOG_LEVEL.lower(),
+        # Uvicorn's own line per request, only wanted when debugging
+        access_log=LOG_LEVEL == 'DEBUG',
+        # Each room's game timer is leader-elected through Redis, so any number of workers (or replicas) can run side by side
+        # The in-memory store can't be shared, so it only ever runs a single worker
+        workers=1 if STORAGE_ENGINE == 'memory' else APP_WORKERS,
+        reload=APP_RELOAD and (APP_WORKERS == 1 or STORAGE_ENGINE == 'memory'),
     )
\ No newline at end of file
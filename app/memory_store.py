@@ -0,0 +1,343 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+
+from game_store import (
+    GameStore,
+    GAME_PHASE_FIELDS,
+    DEFAULT_ROOM_ID,
+    validate_room_id,
+    EVENT_WORDS_APPENDED_CHANNEL,
+    EVENT_WORD_REMOVED_CHANNEL,
+    EVENT_CANDIDATE_UPDATE_CHANNEL,
+    EVENT_CANDIDATE_VOTE_CHANNEL,
+    EVENT_CANDIDATE_EXPIRED_CHANNEL,
+    EVENT_WORD_FLAG_CHANNEL,
+    EVENT_USER_COUNT
+)
+
+# Number of events kept in the event log before the oldest ones are dropped
+EVENT_LOG_MAX_LENGTH = 10000
+# Number of actions between sweeps of expired phrase cooldowns and rate limit windows
+SWEEP_INTERVAL = 10000
+# Rate limit windows without a request for this long are dropped by the sweep (longer than any configured window)
+RATE_LIMIT_WINDOW_RETENTION_SECONDS = 3600
+
+
+class MemoryRoom:
+    """Everything a room holds, as plain Python structures."""
+
+    def __init__(self):
+        self.seq = 0
+        self.game_phase: dict = {}
+        self.lease_token = None
+        self.lease_expires_at = 0
+        # Word id -> {"word", "creator", "flags"}, in story order: ids only grow, and dicts keep insertion order,
+        # so like the story_words index on Redis a word is found and removed by its id without a scan
+        self.words: dict[int, dict] = {}
+        self.story_version = 0
+        self.word_autoincr = 0
+        # Candidate id -> {"phrase", "creator", "expiration_utc_time", "votes"}
+        self.candidates: dict[int, dict] = {}
+        self.candidate_autoincr = 0
+        # Phrase -> when its submission cooldown ends
+        self.cooldown_phrases: dict[str, float] = {}
+        # Worker id -> (open connections, when its heartbeat runs out), and the last announced total
+        self.presence: dict[str, tuple[int, float]] = {}
+        self.user_count = 0
+        # (action, client ip) -> times of the requests in the client's window
+        self.rate_limit_windows: dict[tuple, deque] = {}
+        self.actions = 0
+        # Queues of the live listeners, and the log of (id, event type, data, seq, publish time) in event log mode
+        self.listeners: set[asyncio.Queue] = set()
+        self.event_log = deque(maxlen=EVENT_LOG_MAX_LENGTH)
+        # Set (and replaced) every time an event is logged, to wake up blocked log readers
+        self.event_logged = asyncio.Event()
+
+
+class MemoryGameStore(GameStore):
+    """
+    Keeps rooms in this process' memory: dicts for the story and candidates, asyncio queues
+    for pub/sub. Only suited to a single worker, but there's no network hop or encoding on any operation.
+    Methods never await while changing a room, so each one is atomic like its Redis script counterpart.
+    Expiring things (candidates, cooldowns, rate limit windows) are checked against the clock when they're
+    used, and candidates are retired with events by the timer leader, same as with Redis.
+    """
+
+    def __init__(self, event_log=False, room_id=DEFAULT_ROOM_ID, rooms: dict[str, MemoryRoom] | None = None):
+        validate_room_id(room_id)
+        self.event_log = event_log
+        self.room_id = room_id
+        # Shared by every store handed out by for_room
+        self.rooms = rooms if rooms is not None else {}
+        self.room = self.rooms.setdefault(room_id, MemoryRoom())
+
+    shared_across_workers = False
+
+    def for_room(self, room_id: str) -> "MemoryGameStore":
+        return MemoryGameStore(self.event_log, room_id, self.rooms)
+
+    async def drop_room(self) -> None:
+        self.rooms.pop(self.room_id, None)
+
+
+    def emit(self, event_type: str, payload: str) -> None:
+        room = self.room
+        room.seq += 1
+        body = payload[1:]
+        if body != "}":
+            body = ", " + body
+        data = f'{{"seq": {room.seq}{body}'.encode()
+        published_at = time.time()
+        if self.event_log:
+            room.event_log.append((f"{room.seq}-0".encode(), event_type.encode(), data, room.seq, published_at))
+            room.event_logged.set()
+            room.event_logged = asyncio.Event()
+        else:
+            for listener in room.listeners:
+                listener.put_nowait((event_type.encode(), data, published_at))
+
+    def sweep(self, now: float) -> None:
+        room = self.room
+        room.actions += 1
+        if room.actions % SWEEP_INTERVAL:
+            return
+        room.cooldown_phrases = {phrase: until for phrase, until in room.cooldown_phrases.items() if until > now}
+        room.rate_limit_windows = {key: window for key, window in room.rate_limit_windows.items()
+                                   if window and window[-1] > now - RATE_LIMIT_WINDOW_RETENTION_SECONDS}
+
+    @staticmethod
+    def candidate_json(candidate_id: int, candidate: dict, expiration) -> str:
+        return json.dumps({
+            "candidate_id": candidate_id,
+            "phrase": candidate["phrase"],
+            "votes": [*candidate["votes"]],
+            "creator": candidate["creator"],
+            "expiration_utc_time": expiration
+        })
+
+
+    async def heartbeat_presence(self, worker_id: str, connections: int, now: float, ttl_seconds: float) -> None:
+        self.room.presence[worker_id] = (connections, now + ttl_seconds)
+
+    async def broadcast_presence(self, token: str, now: float) -> int | None:
+        room = self.room
+        if not self.holds_lease(token):
+            return None
+        room.presence = {worker_id: (connections, expires_at)
+                         for worker_id, (connections, expires_at) in room.presence.items() if expires_at > now}
+        total = sum(connections for connections, _ in room.presence.values())
+        if total != room.user_count:
+            room.user_count = total
+            self.emit(EVENT_USER_COUNT, f'{{"user_count": {total}}}')
+        return total
+
+
+    async def acquire_timer_lease(self, token: str, lease_seconds: float) -> bool:
+        room = self.room
+        now = time.time()
+        if room.lease_token == token or room.lease_token is None or room.lease_expires_at <= now:
+            room.lease_token = token
+            room.lease_expires_at = now + lease_seconds
+            return True
+        return False
+
+    async def release_timer_lease(self, token: str) -> None:
+        if self.room.lease_token == token:
+            self.room.lease_token = None
+
+    def holds_lease(self, token: str) -> bool:
+        return self.room.lease_token == token and self.room.lease_expires_at > time.time()
+
+    async def get_game_phase(self) -> list:
+        return [self.room.game_phase.get(field) for field in GAME_PHASE_FIELDS]
+
+    async def set_game_phase(self, token: str, event_type: str, game_phase: dict) -> bool:
+        if not self.holds_lease(token):
+            return False
+        self.room.game_phase = dict(game_phase)
+        self.emit(event_type, json.dumps(game_phase))
+        return True
+
+    async def start_game(self, token: str, event_type: str, game_phase: dict) -> bool:
+        if not self.holds_lease(token):
+            return False
+        await self.clear_game()
+        return await self.set_game_phase(token, event_type, game_phase)
+
+    async def expire_candidates(self, token: str, now: float) -> float | None:
+        if not self.holds_lease(token):
+            return None
+        candidates = self.room.candidates
+        for candidate_id in [cid for cid, candidate in candidates.items() if candidate["expiration_utc_time"] <= now]:
+            del candidates[candidate_id]
+            self.emit(EVENT_CANDIDATE_EXPIRED_CHANNEL, f'{{"candidate_id": {candidate_id}}}')
+        return min((candidate["expiration_utc_time"] for candidate in candidates.values()), default=None)
+
+    async def clear_game(self) -> None:
+        room = self.room
+        room.words.clear()
+        room.story_version = 0
+        room.candidates.clear()
+        room.cooldown_phrases.clear()
+        # Same as resetting the Redis autoincrement keys back to 1
+        room.candidate_autoincr = 1
+        room.word_autoincr = 1
+
+
+    async def hit_rate_limit(self, action: str, client_ip: str, limit: int, window_seconds: float, now: float) -> float:
+        self.sweep(now)
+        window = self.room.rate_limit_windows.setdefault((action, client_ip), deque())
+        while window and window[0] <= now - window_seconds:
+            window.popleft()
+        if len(window) >= limit:
+            return max(0.001, window[0] + window_seconds - now)
+        window.append(now)
+        return 0
+
+    async def submit_candidate(self, phrase: str, client_ip: str, now: float, decay_seconds: int,
+                               cooldown_seconds: int) -> int | None:
+        room = self.room
+        self.sweep(now)
+        if room.cooldown_phrases.get(phrase, 0) > now:
+            return None
+        room.cooldown_phrases[phrase] = now + cooldown_seconds
+        room.candidate_autoincr += 1
+        candidate_id = room.candidate_autoincr
+        candidate = {
+            "phrase": phrase,
+            "creator": client_ip,
+            "expiration_utc_time": round(now + decay_seconds, 3),
+            "votes": set()
+        }
+        room.candidates[candidate_id] = candidate
+        self.emit(EVENT_CANDIDATE_UPDATE_CHANNEL, self.candidate_json(candidate_id, candidate, candidate["expiration_utc_time"]))
+        return candidate_id
+
+    async def vote(self, candidate_id: int, client_ip: str, now: float, vote_threshold: int,
+                   cooldown_seconds: int) -> int | None:
+        room = self.room
+        candidate = room.candidates.get(candidate_id)
+        if candidate is None or candidate["expiration_utc_time"] <= now or candidate["creator"] == client_ip:
+            # Not a live candidate, or the client is voting for its own phrase
+            return None
+
+        votes = candidate["votes"]
+        vote_added = client_ip not in votes
+        if vote_added:
+            votes.add(client_ip)
+            # Reset the phrase's submission cooldown
+            room.cooldown_phrases[candidate["phrase"]] = now + cooldown_seconds
+        else:
+            # Voting again un-votes
+            votes.discard(client_ip)
+
+        if len(votes) < vote_threshold:
+            # Whole seconds left, like a Redis TTL
+            ttl = round(candidate["expiration_utc_time"] - now)
+            if vote_added:
+                # Votes keep the candidate alive for longer
+                ttl += len(votes)
+            candidate["expiration_utc_time"] = round(now + ttl, 3)
+            self.emit(EVENT_CANDIDATE_VOTE_CHANNEL, self.candidate_json(candidate_id, candidate, candidate["expiration_utc_time"]))
+            return 1
+
+        # The vote crossed the threshold: retire the candidate and append its words to the story
+        del room.candidates[candidate_id]
+        self.emit(EVENT_CANDIDATE_VOTE_CHANNEL, self.candidate_json(candidate_id, candidate, None))
+        word_items = []
+        for word in candidate["phrase"].split():
+            room.word_autoincr += 1
+            word_id = room.word_autoincr
+            room.words[word_id] = {"word": word, "creator": candidate["creator"], "flags": set()}
+            word_items.append({"word_id": word_id, "word": word, "flags": [], "creator": candidate["creator"]})
+        room.story_version += 1
+        self.emit(EVENT_WORDS_APPENDED_CHANNEL, json.dumps({"story_version": room.story_version, "words": word_items}))
+        return 2
+
+    async def flag_word(self, word_id: int, client_ip: str, flag_threshold: int) -> int | None:
+        room = self.room
+        word = room.words.get(word_id)
+        if word is None:
+            return None
+        flags = word["flags"]
+        if client_ip in flags:
+            flags.discard(client_ip)
+        else:
+            flags.add(client_ip)
+        if len(flags) >= flag_threshold:
+            del room.words[word_id]
+            room.story_version += 1
+            self.emit(EVENT_WORD_REMOVED_CHANNEL, json.dumps({"story_version": room.story_version, "word_id": word_id}))
+            return 2
+        self.emit(EVENT_WORD_FLAG_CHANNEL, json.dumps({"word_id": word_id, "flags": [*flags]}))
+        return 1
+
+
+    def story_items(self) -> list:
+        return [(word_id, word["word"], word["creator"], [*word["flags"]]) for word_id, word in self.room.words.items()]
+
+    async def read_game_state(self) -> list:
+        room = self.room
+        now = time.time()
+        latest_event = room.event_log[-1][0].decode() if room.event_log else None
+        return [
+            room.seq,
+            latest_event,
+            [room.game_phase.get(field) for field in GAME_PHASE_FIELDS],
+            room.story_version,
+            self.story_items(),
+            [(candidate_id, candidate["phrase"], candidate["creator"], candidate["expiration_utc_time"], [*candidate["votes"]])
+             for candidate_id, candidate in room.candidates.items() if candidate["expiration_utc_time"] > now],
+            room.user_count
+        ]
+
+    async def read_story(self) -> list:
+        return [self.room.story_version, self.story_items()]
+
+
+    async def listen_events(self):
+        queue = asyncio.Queue()
+        self.room.listeners.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.room.listeners.discard(queue)
+
+    def events_after(self, seq: int) -> list:
+        # Log entries have consecutive seqs, so the position of `seq` is known without searching
+        event_log = self.room.event_log
+        if not event_log:
+            return []
+        first_seq = event_log[0][3]
+        return [*itertools.islice(event_log, max(0, seq - first_seq + 1), None)]
+
+    async def read_event_log(self, last_event_id: str, block_millis: int) -> list:
+        last_seq = int(last_event_id.split("-")[0])
+        entries = self.events_after(last_seq)
+        if not entries:
+            event_logged = self.room.event_logged
+            try:
+                await asyncio.wait_for(event_logged.wait(), block_millis / 1000)
+            except asyncio.TimeoutError:
+                return []
+            entries = self.events_after(last_seq)
+        return [(event_id, event_type, data, published_at) for event_id, event_type, data, _, published_at in entries]
+
+    async def get_latest_event_id(self) -> str:
+        return self.room.event_log[-1][0].decode() if self.room.event_log else "0-0"
+
+    async def get_events_since(self, last_event_id: str):
+        try:
+            last_seq = int(last_event_id.split("-")[0])
+        except ValueError:
+            return None
+        event_log = self.room.event_log
+        if not event_log or not event_log[0][3] <= last_seq <= event_log[-1][3]:
+            # `last_event_id` has been dropped from the log (or never was in it)
+            return None
+        return last_seq, [(event_id, event_type, data, seq)
+                          for event_id, event_type, data, seq, _ in self.events_after(last_seq)]
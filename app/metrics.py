@@ -0,0 +1,241 @@
+"""
+In-process metrics, exposed on /metrics in the Prometheus text format.
+
+Recording a sample is a dict lookup and a few additions, with no locks, I/O or allocation on the hot path,
+so instrumentation can stay on under load. Every worker keeps (and serves) its own numbers, so scrape each
+worker, or run a single one per replica.
+"""
+import functools
+import time
+from bisect import bisect_left
+
+# Bucket upper bounds (seconds) of the latency histograms, from a Redis round trip up to a slow snapshot read
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Bucket upper bounds of the per-client queue depth histogram (SUBSCRIBER_QUEUE_MAX_SIZE is the last one that matters)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        # Label values -> child holding the samples for them
+        self.children = {}
+
+    def labels(self, *label_values):
+        child = self.children.get(label_values)
+        if child is None:
+            child = self.children[label_values] = self.new_child()
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, child in self.children.items():
+            lines.extend(self.render_child(label_values, child))
+        return lines
+
+    def render_child(self, label_values: tuple, child) -> list[str]:
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {child.value}"]
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+
+class GaugeChild(CounterChild):
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+
+class HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # One count per bucket, plus the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def render_child(self, label_values: tuple, child) -> list[str]:
+        lines = []
+        cumulative = 0
+        for upper_bound, count in zip((*self.buckets, "+Inf"), child.counts):
+            cumulative += count
+            le = format_labels(self.label_names, label_values, f'le="{upper_bound}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+ROUTE_LATENCY = REGISTRY.register(Histogram(
+    "zibbit_http_request_duration_seconds",
+    "Time from receiving a request to sending its response headers, by route.",
+    ("method", "route", "status")))
+GAME_METHOD_LATENCY = REGISTRY.register(Histogram(
+    "zibbit_game_method_duration_seconds",
+    "Duration of ZibbitGame methods.",
+    ("method",)))
+GAME_METHOD_ERRORS = REGISTRY.register(Counter(
+    "zibbit_game_method_errors_total",
+    "ZibbitGame method calls that raised.",
+    ("method",)))
+REDIS_ROUND_TRIPS = REGISTRY.register(Counter(
+    "zibbit_redis_round_trips_total",
+    "Redis commands sent, by command (game scripts all count as EVALSHA).",
+    ("command",)))
+SSE_CONNECTIONS = REGISTRY.register(Gauge(
+    "zibbit_sse_connections",
+    "Open /events streams, by room.",
+    ("room",)))
+SSE_DROPPED = REGISTRY.register(Counter(
+    "zibbit_sse_dropped_total",
+    "Streams closed by the hub because their client fell too far behind, by room.",
+    ("room",)))
+SSE_QUEUE_DEPTH = REGISTRY.register(Histogram(
+    "zibbit_sse_queue_depth",
+    "Events still buffered in a client's queue each time one of its events is written out.",
+    buckets=QUEUE_DEPTH_BUCKETS))
+FANOUT_LAG = REGISTRY.register(Histogram(
+    "zibbit_fanout_lag_seconds",
+    "Time from an event being published by the game store to it being written to a client's stream "
+    "(with Redis, measured from Redis' clock, so it includes the pub/sub or event log hop)."))
+WS_CONNECTIONS = REGISTRY.register(Gauge(
+    "zibbit_ws_connections",
+    "Open /ws connections, by room.",
+    ("room",)))
+WS_ACTION_LATENCY = REGISTRY.register(Histogram(
+    "zibbit_ws_action_duration_seconds",
+    "Time from receiving an action on a WebSocket to sending its ack, by action and ack status.",
+    ("action", "status")))
+CONNECTIONS_SHED = REGISTRY.register(Counter(
+    "zibbit_connections_shed_total",
+    "New /events and /ws connections sent away with a `retry:` delay, because the worker was draining or too busy.",
+    ("reason",)))
+EVENTS_DISPATCHED = REGISTRY.register(Counter(
+    "zibbit_events_dispatched_total",
+    "Events received by this worker's hubs, by event type.",
+    ("event_type",)))
+
+
+def timed(method):
+    """Records the duration of an async ZibbitGame method in GAME_METHOD_LATENCY."""
+    latency = GAME_METHOD_LATENCY.labels(method.__name__)
+    errors = GAME_METHOD_ERRORS.labels(method.__name__)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def count_round_trips(client):
+    """Makes a Redis client count every command it sends in REDIS_ROUND_TRIPS."""
+    execute_command = client.execute_command
+
+    async def counted_execute_command(*args, **options):
+        REDIS_ROUND_TRIPS.labels(str(args[0]).upper()).inc()
+        return await execute_command(*args, **options)
+
+    client.execute_command = counted_execute_command
+    return client
+
+
+class RouteMetricsMiddleware:
+    """
+    ASGI middleware recording ROUTE_LATENCY. The route label is the matched path template
+    (ex. /rooms/{room_id}/vote), so it doesn't grow with room ids. Streams are timed up to their first bytes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                # Anything that didn't match a route (static files included) shares one label
+                path = getattr(route, "path", None) or "other"
+                ROUTE_LATENCY.labels(scope["method"], path, str(message["status"])).observe(time.perf_counter() - start)
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
@@ -0,0 +1,78 @@
+import time
+from collections import deque
+
+from zibbit import ZibbitGame
+
+# Default (max requests, window seconds) allowed per client for each rate limited action
+DEFAULT_RATE_LIMITS = {
+    "submit_candidate": (5, 10),
+    "vote": (30, 10),
+    "flag_word": (10, 10),
+}
+# Number of checks between sweeps of the in-process windows that have gone quiet
+LOCAL_SWEEP_INTERVAL = 10000
+
+
+def parse_rate_limit(value: str) -> tuple[int, float] | None:
+    """Parses "<max requests>/<window seconds>" (ex. "5/10"), an empty value or "0" turns the limit off."""
+    if not value or value.strip() == "0":
+        return None
+    limit, window_seconds = value.split("/")
+    return int(limit), float(window_seconds)
+
+
+class RateLimiter:
+    """
+    Per-client, per-action sliding window rate limits. The shared window lives in Redis and is checked and
+    updated by a single script call. In front of it, each worker keeps its own window of the requests it let
+    through and remembers refusals until they run out, so a flood from one client is turned away without
+    touching Redis. Both only ever refuse requests Redis would have refused too.
+    """
+
+    def __init__(self, rate_limits: dict[str, tuple[int, float] | None]):
+        self.rate_limits = rate_limits
+        # (room id, action, client ip) -> timestamps of the requests this worker let through in the window
+        self.local_windows: dict[tuple, deque] = {}
+        # (room id, action, client ip) -> when the client's last refusal runs out
+        self.refused_until: dict[tuple, float] = {}
+        self.checks = 0
+
+    async def check(self, game: ZibbitGame, action: str, client_ip: str) -> float:
+        """Returns 0 if the request is allowed, otherwise the number of seconds the client should wait."""
+        rate_limit = self.rate_limits.get(action)
+        if rate_limit is None:
+            return 0
+        limit, window_seconds = rate_limit
+        now = time.time()
+        self.checks += 1
+        if self.checks % LOCAL_SWEEP_INTERVAL == 0:
+            self.sweep(now)
+
+        client_key = (game.room_id, action, client_ip)
+        refused_until = self.refused_until.get(client_key, 0)
+        if refused_until > now:
+            return refused_until - now
+        local_window = self.local_windows.setdefault(client_key, deque(maxlen=limit))
+        while local_window and local_window[0] <= now - window_seconds:
+            local_window.popleft()
+        if len(local_window) >= limit:
+            # This worker alone already let `limit` requests through in the window
+            return local_window[0] + window_seconds - now
+
+        retry_after = await game.hit_rate_limit(action, client_ip, limit, window_seconds)
+        if retry_after:
+            self.refused_until[client_key] = now + retry_after
+        else:
+            local_window.append(now)
+        return retry_after
+
+    def sweep(self, now: float) -> None:
+        max_window_seconds = max((rate_limit[1] for rate_limit in self.rate_limits.values() if rate_limit), default=0)
+        self.local_windows = {
+            client_key: local_window for client_key, local_window in self.local_windows.items()
+            if local_window and local_window[-1] > now - max_window_seconds
+        }
+        self.refused_until = {
+            client_key: refused_until for client_key, refused_until in self.refused_until.items()
+            if refused_until > now
+        }
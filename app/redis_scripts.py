@@ -0,0 +1,369 @@
+"""
+Lua scripts for game transitions that have to read and write several keys atomically.
+They're registered once per client and run through EVALSHA, so a whole transition is one round trip.
+
+Scripts that publish game events start with EVENT_SCRIPT_PRELUDE, which reserves KEYS[1..2] for the
+event log stream and event sequence, and ARGV[1..3] for how events are published
+(see ZibbitGame.run_event_script). Script specific keys and args follow those.
+
+Every script only touches the keys of a single room. Keys the scripts build from a prefix (ex. a
+candidate's hash) carry the same room hash tag as the declared keys, so they live on the same cluster slot.
+"""
+
+# KEYS[1]: event log stream
+# KEYS[2]: event sequence, every event is stamped with the next number as its "seq"
+# ARGV[1]: '1' to append events to the event log stream, '0' to publish them on pub/sub channels
+# ARGV[2]: pub/sub channel prefix
+# ARGV[3]: approximate max length of the event log stream
+# Every event also carries the Redis time it was published at (seconds), outside of its payload:
+# as a stream field, or as the last part of its channel name (<prefix>:<event type>:<published at>)
+EVENT_SCRIPT_PRELUDE = """
+local function emit(event_type, payload)
+    local seq = redis.call('INCR', KEYS[2])
+    local body = string.sub(payload, 2)
+    if body ~= '}' then
+        body = ', ' .. body
+    end
+    payload = '{"seq": ' .. seq .. body
+    local time = redis.call('TIME')
+    local published_at = time[1] .. '.' .. string.format('%06d', tonumber(time[2]))
+    if ARGV[1] == '1' then
+        redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', 'event', event_type, 'data', payload, 'seq', seq,
+            'published_at', published_at)
+    else
+        redis.call('PUBLISH', ARGV[2] .. ':' .. event_type .. ':' .. published_at, payload)
+    end
+end
+
+-- cjson encodes an empty table as an object, so arrays are encoded by hand
+local function json_array(items)
+    if #items == 0 then
+        return '[]'
+    end
+    return cjson.encode(items)
+end
+
+local function candidate_json(candidate_id, phrase, votes, creator, expiration)
+    return '{"candidate_id": ' .. candidate_id ..
+        ', "phrase": ' .. cjson.encode(phrase) ..
+        ', "votes": ' .. json_array(votes) ..
+        ', "creator": ' .. cjson.encode(creator) ..
+        ', "expiration_utc_time": ' .. expiration .. '}'
+end
+"""
+
+# Moves the game into a new phase, as long as the caller still holds the timer leader lease.
+# KEYS: [3] game phase hash, [4] timer leader lease
+# ARGV: [4] leader token, [5] event type, [6] JSON payload, [7...] field, value pairs of the new phase
+# Returns nil if the caller isn't the leader, otherwise 1
+SET_GAME_PHASE_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+if redis.call('GET', KEYS[4]) ~= ARGV[4] then
+    return nil
+end
+redis.call('DEL', KEYS[3])
+redis.call('HSET', KEYS[3], unpack(ARGV, 7))
+emit(ARGV[5], ARGV[6])
+return 1
+"""
+
+# Wipes the previous game (story, candidates, phrase cooldowns, ids) and starts the next one, as long as the
+# caller still holds the timer leader lease, so a worker that lost it can't clear a game the new leader started.
+# KEYS: [3] game phase hash, [4] timer leader lease, [5] story words, [6] story version, [7] candidates index,
+#       [8] cooldown phrases index, [9] candidate autoincrement, [10] word autoincrement
+# ARGV: [4] leader token, [5] story word key prefix, [6] story flag key prefix, [7] candidate key prefix,
+#       [8] candidate votes key prefix, [9] cooldown phrase key prefix, [10] event type, [11] JSON payload,
+#       [12...] field, value pairs of the new phase
+# Returns nil if the caller isn't the leader, otherwise 1
+START_GAME_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+if redis.call('GET', KEYS[4]) ~= ARGV[4] then
+    return nil
+end
+for _, word_id in ipairs(redis.call('ZRANGE', KEYS[5], 0, -1)) do
+    redis.call('DEL', ARGV[5] .. ':' .. word_id, ARGV[6] .. ':' .. word_id)
+end
+for _, candidate_id in ipairs(redis.call('ZRANGE', KEYS[7], 0, -1)) do
+    redis.call('DEL', ARGV[7] .. ':' .. candidate_id, ARGV[8] .. ':' .. candidate_id)
+end
+for _, phrase in ipairs(redis.call('ZRANGE', KEYS[8], 0, -1)) do
+    redis.call('DEL', ARGV[9] .. ':' .. phrase)
+end
+redis.call('DEL', KEYS[5], KEYS[6], KEYS[7], KEYS[8])
+redis.call('SET', KEYS[9], 1)
+redis.call('SET', KEYS[10], 1)
+redis.call('DEL', KEYS[3])
+redis.call('HSET', KEYS[3], unpack(ARGV, 12))
+emit(ARGV[10], ARGV[11])
+return 1
+"""
+
+# Acquires the timer leader lease if nobody holds it, or extends it if the caller already does.
+# KEYS: [1] timer leader lease
+# ARGV: [1] leader token, [2] lease length in milliseconds
+# Returns 1 if the caller holds the lease, otherwise 0
+ACQUIRE_LEASE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not holder then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Gives up the timer leader lease, but only if the caller still holds it.
+# KEYS: [1] timer leader lease
+# ARGV: [1] leader token
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Retires every candidate whose expiration has passed and announces it, as long as the caller still
+# holds the timer leader lease. Candidate keys also carry a TTL, this just makes the expiry visible on time.
+# KEYS: [3] candidates index, [4] timer leader lease
+# ARGV: [4] leader token, [5] now, [6] candidate key prefix, [7] candidate votes key prefix
+# Returns nil if the caller isn't the leader, otherwise the next candidate expiration (or -1 if there's none)
+EXPIRE_CANDIDATES_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+if redis.call('GET', KEYS[4]) ~= ARGV[4] then
+    return nil
+end
+for _, candidate_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[5])) do
+    redis.call('ZREM', KEYS[3], candidate_id)
+    redis.call('DEL', ARGV[6] .. ':' .. candidate_id, ARGV[7] .. ':' .. candidate_id)
+    emit('candidate_expired', '{"candidate_id": ' .. candidate_id .. '}')
+end
+local next_candidate = redis.call('ZRANGE', KEYS[3], 0, 0, 'WITHSCORES')
+return next_candidate[2] or '-1'
+"""
+
+# Records a worker's number of open connections to a room, until its heartbeat runs out.
+# KEYS: [1] presence counts hash, [2] presence expiry index
+# ARGV: [1] worker id, [2] connection count, [3] now, [4] heartbeat ttl seconds
+HEARTBEAT_PRESENCE_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[1])
+-- Once no worker heartbeats anymore, the room's presence keys go away on their own
+local ttl = math.ceil(tonumber(ARGV[4])) * 2
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[2], ttl)
+return 1
+"""
+
+# Drops the workers whose heartbeat ran out, sums the connections of the others and announces the total
+# if it changed since the last announcement, as long as the caller still holds the timer leader lease.
+# KEYS: [3] timer leader lease, [4] presence counts hash, [5] presence expiry index, [6] last published user count
+# ARGV: [4] leader token, [5] now
+# Returns nil if the caller isn't the leader, otherwise the total
+BROADCAST_PRESENCE_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+if redis.call('GET', KEYS[3]) ~= ARGV[4] then
+    return nil
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', ARGV[5])
+if #expired > 0 then
+    redis.call('HDEL', KEYS[4], unpack(expired))
+    redis.call('ZREMRANGEBYSCORE', KEYS[5], '-inf', ARGV[5])
+end
+local total = 0
+for _, connections in ipairs(redis.call('HVALS', KEYS[4])) do
+    total = total + tonumber(connections)
+end
+if tonumber(redis.call('GET', KEYS[6]) or '0') ~= total then
+    redis.call('SET', KEYS[6], total)
+    emit('user_count', '{"user_count": ' .. total .. '}')
+end
+return total
+"""
+
+# Sliding window rate limit: counts the client's requests in the last window and records this one if it's allowed.
+# KEYS: [1] client's window (sorted set of request ids scored by time)
+# ARGV: [1] now in milliseconds, [2] window length in milliseconds, [3] max requests per window, [4] request id
+# Returns 0 if the request is allowed, otherwise the milliseconds until it would be
+RATE_LIMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return math.max(1, tonumber(oldest[2]) + window - now)
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 0
+"""
+
+# Creates a candidate unless its phrase is still in its submission cooldown.
+# KEYS: [3] phrase cooldown key, [4] candidate autoincrement id, [5] candidates index, [6] cooldown phrases index
+# ARGV: [4] phrase, [5] client ip, [6] now, [7] candidate decay seconds, [8] submission cooldown seconds,
+#       [9] candidate key prefix
+# Returns nil if the phrase is in cooldown, otherwise the new candidate id
+SUBMIT_CANDIDATE_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+if not redis.call('SET', KEYS[3], 'cooldown', 'NX', 'EX', ARGV[8]) then
+    return nil
+end
+-- Lazily drop cooldown index entries whose keys have already expired (expired candidates are
+-- dropped from their index by EXPIRE_CANDIDATES_SCRIPT, which announces them)
+redis.call('ZREMRANGEBYSCORE', KEYS[6], '-inf', ARGV[6])
+redis.call('ZADD', KEYS[6], tonumber(ARGV[6]) + tonumber(ARGV[8]), ARGV[4])
+
+local candidate_id = redis.call('INCR', KEYS[4])
+local candidate_key = ARGV[9] .. ':' .. candidate_id
+local expiration = string.format('%.3f', tonumber(ARGV[6]) + tonumber(ARGV[7]))
+redis.call('ZADD', KEYS[5], expiration, candidate_id)
+redis.call('HSET', candidate_key,
+    'candidate_id', candidate_id,
+    'phrase', ARGV[4],
+    'creator', ARGV[5],
+    'expiration_utc_time', expiration)
+redis.call('EXPIRE', candidate_key, ARGV[7])
+emit('candidate_update', candidate_json(candidate_id, ARGV[4], {}, ARGV[5], expiration))
+return candidate_id
+"""
+
+# Toggles one client's vote on a candidate. Adding a vote extends the candidate's TTL by its vote count,
+# and once the candidate reaches the vote threshold its phrase is moved into the story.
+# KEYS: [3] candidate hash, [4] candidate votes set, [5] story words index, [6] story version,
+#       [7] word autoincrement id, [8] candidates index, [9] cooldown phrases index
+# ARGV: [4] candidate id, [5] client ip, [6] now, [7] vote threshold, [8] submission cooldown seconds,
+#       [9] phrase cooldown key prefix, [10] word hash key prefix
+# Returns nil if the vote isn't allowed, 1 if the vote was counted, 2 if it promoted the candidate
+VOTE_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+local candidate = redis.call('HMGET', KEYS[3], 'phrase', 'creator')
+local phrase, creator = candidate[1], candidate[2]
+if not phrase or creator == ARGV[5] then
+    -- Not a live candidate, or the client is voting for its own phrase
+    return nil
+end
+
+local vote_added = redis.call('SISMEMBER', KEYS[4], ARGV[5]) == 0
+if vote_added then
+    redis.call('SADD', KEYS[4], ARGV[5])
+    -- Reset the phrase's submission cooldown
+    redis.call('SET', ARGV[9] .. ':' .. phrase, 'cooldown', 'EX', ARGV[8])
+    redis.call('ZADD', KEYS[9], tonumber(ARGV[6]) + tonumber(ARGV[8]), phrase)
+else
+    -- Voting again un-votes
+    redis.call('SREM', KEYS[4], ARGV[5])
+end
+local votes = redis.call('SMEMBERS', KEYS[4])
+
+if #votes < tonumber(ARGV[7]) then
+    local ttl = redis.call('TTL', KEYS[3])
+    if vote_added then
+        -- Votes keep the candidate alive for longer
+        ttl = ttl + #votes
+    end
+    local expiration = string.format('%.3f', tonumber(ARGV[6]) + ttl)
+    redis.call('HSET', KEYS[3], 'expiration_utc_time', expiration)
+    redis.call('EXPIRE', KEYS[3], ttl)
+    redis.call('EXPIRE', KEYS[4], ttl)
+    redis.call('ZADD', KEYS[8], expiration, ARGV[4])
+    emit('candidate_vote', candidate_json(ARGV[4], phrase, votes, creator, expiration))
+    return 1
+end
+
+-- The vote crossed the threshold: retire the candidate and append its words to the story
+redis.call('DEL', KEYS[3], KEYS[4])
+redis.call('ZREM', KEYS[8], ARGV[4])
+emit('candidate_vote', candidate_json(ARGV[4], phrase, votes, creator, 'null'))
+
+local words = {}
+for word in string.gmatch(phrase, '[^ ]+') do
+    words[#words + 1] = word
+end
+local first_word_id = redis.call('INCRBY', KEYS[7], #words) - #words + 1
+local word_items = {}
+for idx, word in ipairs(words) do
+    local word_id = first_word_id + idx - 1
+    redis.call('HSET', ARGV[10] .. ':' .. word_id, 'word', word, 'creator', creator)
+    redis.call('ZADD', KEYS[5], word_id, word_id)
+    word_items[idx] = '{"word_id": ' .. word_id ..
+        ', "word": ' .. cjson.encode(word) ..
+        ', "flags": [], "creator": ' .. cjson.encode(creator) .. '}'
+end
+local story_version = redis.call('INCR', KEYS[6])
+emit('words_appended', '{"story_version": ' .. story_version .. ', "words": [' .. table.concat(word_items, ', ') .. ']}')
+return 2
+"""
+
+# Toggles one client's flag on one word, removing the word once it reaches the flag threshold.
+# KEYS: [3] story words index, [4] word hash, [5] word flags set, [6] story version
+# ARGV: [4] word id, [5] client ip, [6] flag threshold
+# Returns nil if the word isn't in the story, 1 if the flag was toggled, 2 if the word was removed
+FLAG_WORD_SCRIPT = EVENT_SCRIPT_PRELUDE + """
+if not redis.call('ZSCORE', KEYS[3], ARGV[4]) then
+    return nil
+end
+if redis.call('SISMEMBER', KEYS[5], ARGV[5]) == 1 then
+    redis.call('SREM', KEYS[5], ARGV[5])
+else
+    redis.call('SADD', KEYS[5], ARGV[5])
+end
+local flags = redis.call('SMEMBERS', KEYS[5])
+if #flags >= tonumber(ARGV[6]) then
+    redis.call('ZREM', KEYS[3], ARGV[4])
+    redis.call('DEL', KEYS[4], KEYS[5])
+    local story_version = redis.call('INCR', KEYS[6])
+    emit('word_removed', '{"story_version": ' .. story_version .. ', "word_id": ' .. ARGV[4] .. '}')
+    return 2
+end
+emit('word_flag', '{"word_id": ' .. ARGV[4] .. ', "flags": ' .. json_array(flags) .. '}')
+return 1
+"""
+
+# Defines read_story(words index, word hash key prefix, word flags key prefix),
+# returning {word_id, word, creator, {flags}} for every story word in order
+STORY_READER_PRELUDE = """
+local function read_story(words_key, word_prefix, flags_prefix)
+    local words = {}
+    for _, word_id in ipairs(redis.call('ZRANGE', words_key, 0, -1)) do
+        local word = redis.call('HMGET', word_prefix .. ':' .. word_id, 'word', 'creator')
+        local flags = redis.call('SMEMBERS', flags_prefix .. ':' .. word_id)
+        words[#words + 1] = {word_id, word[1], word[2], flags}
+    end
+    return words
+end
+"""
+
+# Reads a consistent snapshot of the whole game together with the last event it reflects.
+# KEYS: [1] event log stream, [2] event sequence, [3] game phase hash, [4] story words index, [5] story version,
+#       [6] candidates index, [7] last published user count
+# ARGV: [1] word hash key prefix, [2] word flags key prefix, [3] candidate hash key prefix,
+#       [4] candidate votes key prefix
+# Returns {seq, last event log id, {game status, game start, game end, next game start},
+#          story_version, {story words}, {candidates}, user count}
+READ_GAME_STATE_SCRIPT = STORY_READER_PRELUDE + """
+local latest_event = redis.call('XREVRANGE', KEYS[1], '+', '-', 'COUNT', 1)[1]
+
+-- Candidates stay in the index until their candidate_expired event, skip any whose keys are already gone
+local candidates = {}
+for _, candidate_id in ipairs(redis.call('ZRANGE', KEYS[6], 0, -1)) do
+    local candidate = redis.call('HMGET', ARGV[3] .. ':' .. candidate_id, 'phrase', 'creator', 'expiration_utc_time')
+    if candidate[1] then
+        local votes = redis.call('SMEMBERS', ARGV[4] .. ':' .. candidate_id)
+        candidates[#candidates + 1] = {candidate_id, candidate[1], candidate[2], candidate[3], votes}
+    end
+end
+
+return {
+    tonumber(redis.call('GET', KEYS[2]) or '0'),
+    latest_event and latest_event[1] or false,
+    redis.call('HMGET', KEYS[3], 'game_status', 'game_start_utc_time', 'game_end_utc_time', 'next_game_start_utc_time'),
+    tonumber(redis.call('GET', KEYS[5]) or '0'),
+    read_story(KEYS[4], ARGV[1], ARGV[2]),
+    candidates,
+    tonumber(redis.call('GET', KEYS[7]) or '0')
+}
+"""
+
+# Reads the whole story in order together with the version it's at.
+# KEYS: [1] story words index, [2] story version
+# ARGV: [1] word hash key prefix, [2] word flags key prefix
+# Returns {story_version, {story words}}
+READ_STORY_SCRIPT = STORY_READER_PRELUDE + """
+return {tonumber(redis.call('GET', KEYS[2]) or '0'), read_story(KEYS[1], ARGV[1], ARGV[2])}
+"""
@@ -0,0 +1,368 @@
+import copy
+import itertools
+import json
+
+import redis.asyncio as redis
+
+from metrics import count_round_trips
+from game_store import GameStore, GAME_PHASE_FIELDS, DEFAULT_ROOM_ID, validate_room_id, new_worker_id
+from redis_scripts import (
+    SET_GAME_PHASE_SCRIPT,
+    START_GAME_SCRIPT,
+    EXPIRE_CANDIDATES_SCRIPT,
+    ACQUIRE_LEASE_SCRIPT,
+    RELEASE_LEASE_SCRIPT,
+    RATE_LIMIT_SCRIPT,
+    HEARTBEAT_PRESENCE_SCRIPT,
+    BROADCAST_PRESENCE_SCRIPT,
+    SUBMIT_CANDIDATE_SCRIPT,
+    VOTE_SCRIPT,
+    FLAG_WORD_SCRIPT,
+    READ_GAME_STATE_SCRIPT,
+    READ_STORY_SCRIPT
+)
+
+# Prefix of every key and channel of a room. The room id is wrapped in a Redis Cluster hash tag,
+# so all of a room's keys hash to the same slot and its scripts can run on a single shard.
+ROOM_KEY_PREFIX = "room"
+
+# Stores the current game phase: its status and the timestamps of when it started and ends
+GAME_PHASE_KEY = "game_phase"
+# Stores the token of the worker currently running the game timer
+TIMER_LEADER_KEY = "timer_leader"
+# Stores the ids of the words in the story, scored by word id so they read back in story order
+STORY_WORDS_KEY = "story_words"
+# Prefix for the hash holding a single story word (word, creator)
+STORY_WORD_KEY_PREFIX = "story_word"
+# Stores the story version, bumped every time a word is appended to or removed from the story
+STORY_VERSION_KEY = "story_version"
+# Prefix for phrases that are in cooldown period
+COOLDOWN_PHRASES_KEY_PREFIX = "cooldown_phrases"
+# Index of phrases in cooldown, scored by when their cooldown ends
+COOLDOWN_PHRASES_INDEX_KEY = "cooldown_phrases_index"
+# Prefix for candidate phrases
+CANDIDATES_KEY_PREFIX = "candidates"
+# Prefix for the set of clients that voted for a candidate
+CANDIDATES_VOTES_KEY_PREFIX = "candidate_votes"
+# Index of live candidate ids, scored by their expiration time
+CANDIDATES_INDEX_KEY = "candidates_index"
+# Prefix for a client's rate limit window of a single action (ex. user:vote:<client ip>)
+USER_RATE_LIMIT_PREFIX = "user"
+# Prefix for storing the set of clients that flagged a story word
+STORY_FLAG_KEY_PREFIX = "story_flag"
+# Stores the incrementing ids for candidates
+CANDIDATE_AUTOINCR_KEY = "candidate_autoincr"
+# Stores the incrementing ids for words
+WORD_AUTOINCR_KEY = "word_autoincr"
+# Stores the number of open connections of each worker serving the room
+PRESENCE_KEY = "presence"
+# Index of the workers in the presence hash, scored by when their last heartbeat runs out
+PRESENCE_EXPIRY_KEY = "presence_expiry"
+# Stores the last user count announced to clients
+USER_COUNT_KEY = "user_count"
+
+# Denotes the channel prefix to subscribe to for game updates
+GAME_EVENTS_CHANNEL_PREFIX = "game_events"
+# Stream that stores the game events when the event log mode is enabled
+GAME_EVENTS_STREAM_KEY = "game_events_log"
+# Stores the sequence number of the last published game event
+EVENT_SEQ_KEY = "event_seq"
+# Approximate number of events kept in the event log before the oldest ones are trimmed
+GAME_EVENTS_STREAM_MAX_LENGTH = 10000
+
+
+class RedisGameStore(GameStore):
+    """
+    Keeps a room in Redis, so every worker and replica pointed at the same Redis shares it.
+    Each game transition is a single Lua script (see redis_scripts.py), events go out over pub/sub,
+    or a capped stream in event log mode.
+    """
+
+    def __init__(self, redis_host="redis", redis_port=6379, redis_user="user", redis_pass="pass", event_log=False,
+                 room_id=DEFAULT_ROOM_ID, worker_id: str | None = None):
+        self.set_room(room_id)
+        # When enabled, events are appended to a capped stream instead of plain pub/sub so clients can resume
+        self.event_log = event_log
+        self.redis = count_round_trips(redis.StrictRedis(
+            host=redis_host,
+            port=redis_port,
+            decode_responses=True,
+            username=redis_user,
+            password=redis_pass))
+        # Subscriber and event log payloads are kept as raw bytes so they can be written to clients without re-encoding
+        self.pubsub_redis = count_round_trips(redis.StrictRedis(
+            host=redis_host,
+            port=redis_port,
+            decode_responses=False,
+            username=redis_user,
+            password=redis_pass))
+        self.set_game_phase_script = self.redis.register_script(SET_GAME_PHASE_SCRIPT)
+        self.start_game_script = self.redis.register_script(START_GAME_SCRIPT)
+        self.expire_candidates_script = self.redis.register_script(EXPIRE_CANDIDATES_SCRIPT)
+        self.acquire_lease_script = self.redis.register_script(ACQUIRE_LEASE_SCRIPT)
+        self.release_lease_script = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+        self.rate_limit_script = self.redis.register_script(RATE_LIMIT_SCRIPT)
+        self.heartbeat_presence_script = self.redis.register_script(HEARTBEAT_PRESENCE_SCRIPT)
+        self.broadcast_presence_script = self.redis.register_script(BROADCAST_PRESENCE_SCRIPT)
+        # Makes the ids of the requests recorded in rate limit windows unique across workers
+        self.request_id_prefix = worker_id or new_worker_id()
+        self.request_ids = itertools.count()
+        self.submit_candidate_script = self.redis.register_script(SUBMIT_CANDIDATE_SCRIPT)
+        self.vote_script = self.redis.register_script(VOTE_SCRIPT)
+        self.flag_word_script = self.redis.register_script(FLAG_WORD_SCRIPT)
+        self.read_game_state_script = self.redis.register_script(READ_GAME_STATE_SCRIPT)
+        self.read_story_script = self.redis.register_script(READ_STORY_SCRIPT)
+
+
+    def for_room(self, room_id: str) -> "RedisGameStore":
+        # Shares the Redis connections and registered scripts
+        room = copy.copy(self)
+        room.set_room(room_id)
+        return room
+
+    def set_room(self, room_id: str) -> None:
+        validate_room_id(room_id)
+        self.room_id = room_id
+        self.key_prefix = f"{ROOM_KEY_PREFIX}:{{{room_id}}}"
+
+    def key(self, *parts) -> str:
+        """Builds the name of one of this room's keys (or channels), ex. key(CANDIDATES_KEY_PREFIX, 3)."""
+        return ":".join((self.key_prefix, *map(str, parts)))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+        await self.pubsub_redis.aclose()
+
+
+    async def heartbeat_presence(self, worker_id: str, connections: int, now: float, ttl_seconds: float) -> None:
+        await self.heartbeat_presence_script(
+            keys=[self.key(PRESENCE_KEY), self.key(PRESENCE_EXPIRY_KEY)],
+            args=[worker_id, connections, now, ttl_seconds])
+
+    async def broadcast_presence(self, token: str, now: float) -> int | None:
+        return await self.run_event_script(
+            self.broadcast_presence_script,
+            keys=[
+                self.key(TIMER_LEADER_KEY),
+                self.key(PRESENCE_KEY),
+                self.key(PRESENCE_EXPIRY_KEY),
+                self.key(USER_COUNT_KEY)
+            ],
+            args=[token, now])
+
+
+    async def acquire_timer_lease(self, token: str, lease_seconds: float) -> bool:
+        return bool(await self.acquire_lease_script(
+            keys=[self.key(TIMER_LEADER_KEY)],
+            args=[token, int(lease_seconds * 1000)]))
+
+    async def release_timer_lease(self, token: str) -> None:
+        await self.release_lease_script(keys=[self.key(TIMER_LEADER_KEY)], args=[token])
+
+    async def get_game_phase(self) -> list:
+        return await self.redis.hmget(self.key(GAME_PHASE_KEY), GAME_PHASE_FIELDS)
+
+    async def set_game_phase(self, token: str, event_type: str, game_phase: dict) -> bool:
+        phase_fields = [item for field_and_value in game_phase.items() for item in field_and_value]
+        result = await self.run_event_script(
+            self.set_game_phase_script,
+            keys=[self.key(GAME_PHASE_KEY), self.key(TIMER_LEADER_KEY)],
+            args=[token, event_type, json.dumps(game_phase), *phase_fields])
+        return result is not None
+
+    async def start_game(self, token: str, event_type: str, game_phase: dict) -> bool:
+        phase_fields = [item for field_and_value in game_phase.items() for item in field_and_value]
+        result = await self.run_event_script(
+            self.start_game_script,
+            keys=[
+                self.key(GAME_PHASE_KEY),
+                self.key(TIMER_LEADER_KEY),
+                self.key(STORY_WORDS_KEY),
+                self.key(STORY_VERSION_KEY),
+                self.key(CANDIDATES_INDEX_KEY),
+                self.key(COOLDOWN_PHRASES_INDEX_KEY),
+                self.key(CANDIDATE_AUTOINCR_KEY),
+                self.key(WORD_AUTOINCR_KEY)
+            ],
+            args=[
+                token,
+                self.key(STORY_WORD_KEY_PREFIX),
+                self.key(STORY_FLAG_KEY_PREFIX),
+                self.key(CANDIDATES_KEY_PREFIX),
+                self.key(CANDIDATES_VOTES_KEY_PREFIX),
+                self.key(COOLDOWN_PHRASES_KEY_PREFIX),
+                event_type,
+                json.dumps(game_phase),
+                *phase_fields
+            ])
+        return result is not None
+
+    async def expire_candidates(self, token: str, now: float) -> float | None:
+        next_expiration = await self.run_event_script(
+            self.expire_candidates_script,
+            keys=[self.key(CANDIDATES_INDEX_KEY), self.key(TIMER_LEADER_KEY)],
+            args=[
+                token,
+                now,
+                self.key(CANDIDATES_KEY_PREFIX),
+                self.key(CANDIDATES_VOTES_KEY_PREFIX)
+            ])
+        if next_expiration is None or float(next_expiration) < 0:
+            return None
+        return float(next_expiration)
+
+    async def clear_game(self) -> None:
+        # Clear story
+        word_ids = await self.redis.zrange(self.key(STORY_WORDS_KEY), 0, -1)
+        await self.redis.delete(
+            self.key(STORY_WORDS_KEY),
+            self.key(STORY_VERSION_KEY),
+            *[self.key(STORY_WORD_KEY_PREFIX, word_id) for word_id in word_ids],
+            *[self.key(STORY_FLAG_KEY_PREFIX, word_id) for word_id in word_ids])
+        # Clear candidates, the index only holds live (or just expired) candidates so this never scans the keyspace
+        candidate_ids = await self.redis.zrange(self.key(CANDIDATES_INDEX_KEY), 0, -1)
+        await self.redis.delete(
+            self.key(CANDIDATES_INDEX_KEY),
+            *[self.key(CANDIDATES_KEY_PREFIX, candidate_id) for candidate_id in candidate_ids],
+            *[self.key(CANDIDATES_VOTES_KEY_PREFIX, candidate_id) for candidate_id in candidate_ids])
+        # Clear candidates cooldown set
+        cooldown_phrases = await self.redis.zrange(self.key(COOLDOWN_PHRASES_INDEX_KEY), 0, -1)
+        await self.redis.delete(
+            self.key(COOLDOWN_PHRASES_INDEX_KEY),
+            *[self.key(COOLDOWN_PHRASES_KEY_PREFIX, phrase) for phrase in cooldown_phrases])
+        # Reset autoincrement ids back to 1
+        await self.redis.set(self.key(CANDIDATE_AUTOINCR_KEY), 1)
+        await self.redis.set(self.key(WORD_AUTOINCR_KEY), 1)
+
+
+    async def hit_rate_limit(self, action: str, client_ip: str, limit: int, window_seconds: float, now: float) -> float:
+        retry_after_millis = await self.rate_limit_script(
+            keys=[self.key(USER_RATE_LIMIT_PREFIX, action, client_ip)],
+            args=[int(now * 1000), int(window_seconds * 1000), limit, f"{self.request_id_prefix}:{next(self.request_ids)}"])
+        return retry_after_millis / 1000
+
+    async def submit_candidate(self, phrase: str, client_ip: str, now: float, decay_seconds: int,
+                               cooldown_seconds: int) -> int | None:
+        # The cooldown check, candidate creation and its event happen in one atomic script
+        return await self.run_event_script(
+            self.submit_candidate_script,
+            keys=[
+                self.key(COOLDOWN_PHRASES_KEY_PREFIX, phrase),
+                self.key(CANDIDATE_AUTOINCR_KEY),
+                self.key(CANDIDATES_INDEX_KEY),
+                self.key(COOLDOWN_PHRASES_INDEX_KEY)
+            ],
+            args=[
+                phrase,
+                client_ip,
+                now,
+                decay_seconds,
+                cooldown_seconds,
+                self.key(CANDIDATES_KEY_PREFIX)
+            ])
+
+    async def vote(self, candidate_id: int, client_ip: str, now: float, vote_threshold: int,
+                   cooldown_seconds: int) -> int | None:
+        # Vote toggle, TTL extension, promotion into the story and the events all happen in one atomic script
+        return await self.run_event_script(
+            self.vote_script,
+            keys=[
+                self.key(CANDIDATES_KEY_PREFIX, candidate_id),
+                self.key(CANDIDATES_VOTES_KEY_PREFIX, candidate_id),
+                self.key(STORY_WORDS_KEY),
+                self.key(STORY_VERSION_KEY),
+                self.key(WORD_AUTOINCR_KEY),
+                self.key(CANDIDATES_INDEX_KEY),
+                self.key(COOLDOWN_PHRASES_INDEX_KEY)
+            ],
+            args=[
+                candidate_id,
+                client_ip,
+                now,
+                vote_threshold,
+                cooldown_seconds,
+                self.key(COOLDOWN_PHRASES_KEY_PREFIX),
+                self.key(STORY_WORD_KEY_PREFIX)
+            ])
+
+    async def flag_word(self, word_id: int, client_ip: str, flag_threshold: int) -> int | None:
+        # Only this word's keys are touched, atomically, so concurrent inserts and flags can't clobber each other
+        return await self.run_event_script(
+            self.flag_word_script,
+            keys=[
+                self.key(STORY_WORDS_KEY),
+                self.key(STORY_WORD_KEY_PREFIX, word_id),
+                self.key(STORY_FLAG_KEY_PREFIX, word_id),
+                self.key(STORY_VERSION_KEY)
+            ],
+            args=[word_id, client_ip, flag_threshold])
+
+    async def run_event_script(self, script, keys: list, args: list):
+        """Runs a script built on EVENT_SCRIPT_PRELUDE, which stamps and publishes its own events."""
+        return await script(
+            keys=[self.key(GAME_EVENTS_STREAM_KEY), self.key(EVENT_SEQ_KEY), *keys],
+            args=[int(self.event_log), self.key(GAME_EVENTS_CHANNEL_PREFIX), GAME_EVENTS_STREAM_MAX_LENGTH, *args])
+
+
+    async def read_game_state(self) -> list:
+        return await self.read_game_state_script(
+            keys=[
+                self.key(GAME_EVENTS_STREAM_KEY),
+                self.key(EVENT_SEQ_KEY),
+                self.key(GAME_PHASE_KEY),
+                self.key(STORY_WORDS_KEY),
+                self.key(STORY_VERSION_KEY),
+                self.key(CANDIDATES_INDEX_KEY),
+                self.key(USER_COUNT_KEY)
+            ],
+            args=[
+                self.key(STORY_WORD_KEY_PREFIX),
+                self.key(STORY_FLAG_KEY_PREFIX),
+                self.key(CANDIDATES_KEY_PREFIX),
+                self.key(CANDIDATES_VOTES_KEY_PREFIX)
+            ])
+
+    async def read_story(self) -> list:
+        return await self.read_story_script(
+            keys=[self.key(STORY_WORDS_KEY), self.key(STORY_VERSION_KEY)],
+            args=[self.key(STORY_WORD_KEY_PREFIX), self.key(STORY_FLAG_KEY_PREFIX)])
+
+
+    async def listen_events(self):
+        pubsub = self.pubsub_redis.pubsub()
+        try:
+            await pubsub.psubscribe(f"{self.key(GAME_EVENTS_CHANNEL_PREFIX)}:*")
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                _, event_type, published_at = message["channel"].rsplit(b":", 2)
+                yield event_type, message["data"], float(published_at)
+        finally:
+            await pubsub.close()
+
+    async def read_event_log(self, last_event_id: str, block_millis: int) -> list:
+        response = await self.pubsub_redis.xread({self.key(GAME_EVENTS_STREAM_KEY): last_event_id}, block=block_millis)
+        if not response:
+            return []
+        _, entries = response[0]
+        # Entries logged by workers that didn't stamp them yet have no publish time
+        return [(event_id, fields[b"event"], fields[b"data"], float(fields.get(b"published_at", 0)) or None)
+                for event_id, fields in entries]
+
+    async def get_latest_event_id(self) -> str:
+        latest = await self.pubsub_redis.xrevrange(self.key(GAME_EVENTS_STREAM_KEY), count=1)
+        return latest[0][0].decode() if latest else "0-0"
+
+    async def get_events_since(self, last_event_id: str):
+        try:
+            entries = await self.pubsub_redis.xrange(self.key(GAME_EVENTS_STREAM_KEY), min=last_event_id)
+        except redis.ResponseError:
+            # Not a valid stream id
+            return None
+        if not entries or entries[0][0].decode() != last_event_id:
+            # Either the log was lost or `last_event_id` (and possibly what came right after it) has been trimmed
+            return None
+        (_, last_fields), *missed_entries = entries
+        return int(last_fields[b"seq"]), [
+            (event_id, fields[b"event"], fields[b"data"], int(fields[b"seq"])) for event_id, fields in missed_entries
+        ]
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+
+from zibbit import ZibbitGame, ROOM_ID_PATTERN
+from event_hub import EventHub
+
+# Max number of rooms a single worker will run, rooms beyond that are refused
+MAX_ROOMS_PER_WORKER = 100
+# Seconds a room can go without any client streaming it before the worker stops running it
+ROOM_IDLE_SECONDS = 300
+# Seconds between two looks for idle rooms
+ROOM_REAP_INTERVAL_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+
+class Room:
+    """A single game room on this worker: its game, its event hub and the tasks driving them."""
+
+    def __init__(self, game: ZibbitGame, hub: EventHub):
+        self.game = game
+        self.hub = hub
+        self.tasks: list[asyncio.Task] = []
+        # Last time (monotonic) the room was asked for or had a client
+        self.last_active = time.monotonic()
+
+    @property
+    def room_id(self) -> str:
+        return self.game.room_id
+
+    def start(self) -> None:
+        # Every worker runs each room's timer, the room's leader lease decides which one actually moves it along
+        self.tasks = [
+            asyncio.create_task(self.game.timer_loop()),
+            asyncio.create_task(self.game.presence_loop(lambda: len(self.hub.subscriptions))),
+            asyncio.create_task(self.hub.run())
+        ]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        # Wait for them to be gone, so the timer can't move the game along once the lease is released below
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.hub.drop_all()
+        # Stop counting this worker's clients now rather than when its last heartbeat runs out
+        await self.game.heartbeat_presence(0)
+        await self.game.release_timer_lease()
+        await self.game.store.drop_room()
+
+
+class RoomRegistry:
+    """
+    Rooms this worker is running. Each room has its own keys (all in one cluster slot), event channel and timer,
+    so different rooms spread over the cluster's shards. The pinned rooms run for as long as the worker does,
+    the others are started when a client first streams them and stopped once nobody has for ROOM_IDLE_SECONDS.
+    """
+
+    def __init__(self, game: ZibbitGame, broadcast_tick_seconds: float = 0, max_rooms: int = MAX_ROOMS_PER_WORKER,
+                 pinned_room_ids: list[str] | None = None, idle_seconds: float = ROOM_IDLE_SECONDS):
+        # Other rooms share this game's Redis connections
+        self.game = game
+        self.broadcast_tick_seconds = broadcast_tick_seconds
+        self.max_rooms = max_rooms
+        self.pinned_room_ids = set(pinned_room_ids or ())
+        self.idle_seconds = idle_seconds
+        self.rooms: dict[str, Room] = {}
+        self.reaper_task = None
+
+    def start(self) -> None:
+        for room_id in self.pinned_room_ids:
+            self.get(room_id)
+        self.reaper_task = asyncio.create_task(self.reap_idle_rooms())
+
+    def get(self, room_id: str) -> Room | None:
+        """Returns the room, starting it if needed, or None if the id is invalid or the worker is full."""
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.last_active = time.monotonic()
+            return room
+        if not ROOM_ID_PATTERN.fullmatch(room_id) or len(self.rooms) >= self.max_rooms:
+            return None
+        game = self.game.for_room(room_id)
+        room = Room(game, EventHub(game, broadcast_tick_seconds=self.broadcast_tick_seconds))
+        room.start()
+        self.rooms[room_id] = room
+        logger.info("room_started", extra={"room": room_id})
+        return room
+
+    def get_game(self, room_id: str) -> ZibbitGame | None:
+        """
+        Returns the room's game without starting the room, for requests that only read or change the game.
+        None if the id is invalid, or if the room can only exist on this worker and isn't running.
+        """
+        room = self.rooms.get(room_id)
+        if room is not None:
+            return room.game
+        if not ROOM_ID_PATTERN.fullmatch(room_id) or not self.game.store.shared_across_workers:
+            return None
+        return self.game.for_room(room_id)
+
+    async def reap_idle_rooms(self) -> None:
+        while True:
+            await asyncio.sleep(ROOM_REAP_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for room_id, room in list(self.rooms.items()):
+                if room_id in self.pinned_room_ids:
+                    continue
+                if room.hub.subscriptions:
+                    room.last_active = now
+                elif now - room.last_active >= self.idle_seconds:
+                    # Out of the registry first, so nobody is handed the room while it's stopping
+                    del self.rooms[room_id]
+                    await self.stop_room(room)
+
+    async def stop_room(self, room: Room) -> None:
+        # A room that fails to stop cleanly (ex. Redis is down) mustn't keep the others from stopping
+        try:
+            await room.stop()
+        except Exception:
+            logger.exception("room_stop_failed", extra={"room": room.room_id})
+            return
+        logger.info("room_stopped", extra={"room": room.room_id})
+
+    async def stop_all(self) -> None:
+        if self.reaper_task is not None:
+            self.reaper_task.cancel()
+            await asyncio.gather(self.reaper_task, return_exceptions=True)
+        rooms, self.rooms = self.rooms, {}
+        for room in rooms.values():
+            await self.stop_room(room)
+        # Every room's store shares this game's connections
+        await self.game.store.close()
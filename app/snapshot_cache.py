@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+
+from zibbit import ZibbitGame
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotCache:
+    """
+    Per-worker copy of the game state, kept current by applying the events the hub already consumes.
+    New connections are handed the same pre-serialized snapshot, and Redis is only re-read when the
+    cache is invalidated or a gap shows up in the event sequence numbers.
+    """
+
+    def __init__(self, game: ZibbitGame):
+        self.game = game
+        self.state = None
+        # Sequence number (and event log id) of the last event reflected in `state`
+        self.seq = 0
+        self.event_id = None
+        self.encoded = None
+        self.rebuild_lock = asyncio.Lock()
+        # Events that arrive while a rebuild is reading Redis, applied once it's done
+        self.pending_events = None
+        self.event_handlers = {
+            "game_start": self.apply_game_start,
+            "game_end": self.apply_game_end,
+            "candidate_update": self.apply_candidate_update,
+            "candidate_vote": self.apply_candidate_vote,
+            "candidate_expired": self.apply_candidate_expired,
+            "words_appended": self.apply_words_appended,
+            "word_removed": self.apply_word_removed,
+            "word_flag": self.apply_word_flag,
+            "user_count": self.apply_user_count,
+        }
+
+    def invalidate(self) -> None:
+        self.state = None
+        self.encoded = None
+
+    async def get(self) -> tuple[int, bytes | None, bytes]:
+        """Returns (seq, event log id, JSON encoded game state) for the latest snapshot."""
+        while self.state is None:
+            await self.rebuild()
+        if self.encoded is None:
+            self.encoded = json.dumps(self.state).encode()
+        return self.seq, self.event_id, self.encoded
+
+    async def rebuild(self) -> None:
+        async with self.rebuild_lock:
+            if self.state is not None:
+                # Somebody else rebuilt it while we were waiting
+                return
+            self.pending_events = []
+            try:
+                state = await self.game.get_game_state()
+            finally:
+                pending_events, self.pending_events = self.pending_events, None
+
+            last_event_id = state.pop("last_event_id")
+            self.event_id = last_event_id.encode() if last_event_id else None
+            self.seq = state["seq"]
+            self.state = state
+            self.encoded = None
+            # Anything at or before `seq` is already part of what we read and gets skipped
+            for event_type, payload, event_id in pending_events:
+                self.apply_event(event_type, payload, event_id)
+
+    def apply_event(self, event_type: str, payload: dict, event_id: bytes | None = None) -> None:
+        if self.pending_events is not None:
+            self.pending_events.append((event_type, payload, event_id))
+            return
+        if self.state is None:
+            return
+
+        seq = payload.get("seq", 0)
+        if seq <= self.seq:
+            return
+        handler = self.event_handlers.get(event_type)
+        if seq != self.seq + 1 or handler is None:
+            logger.info("snapshot_invalidated", extra={
+                "room": self.game.room_id, "event_type": event_type, "seq": seq, "snapshot_seq": self.seq})
+            self.invalidate()
+            return
+
+        handler(payload)
+        self.seq = seq
+        self.state["seq"] = seq
+        self.event_id = event_id
+        self.encoded = None
+
+    def apply_game_start(self, payload: dict) -> None:
+        self.state.update({
+            "game_status": payload["game_status"],
+            "game_start_utc_time": payload["game_start_utc_time"],
+            "game_end_utc_time": payload["game_end_utc_time"],
+            "next_game_start_utc_time": None,
+            "story": [],
+            "story_version": 0,
+            "candidates": []
+        })
+
+    def apply_game_end(self, payload: dict) -> None:
+        self.state.update({
+            "game_status": payload["game_status"],
+            "game_start_utc_time": None,
+            "game_end_utc_time": None,
+            "next_game_start_utc_time": payload["next_game_start_utc_time"]
+        })
+
+    def apply_candidate_update(self, payload: dict) -> None:
+        candidate = {key: payload[key] for key in ("candidate_id", "phrase", "votes", "creator", "expiration_utc_time")}
+        self.state["candidates"].append(candidate)
+
+    def apply_candidate_vote(self, payload: dict) -> None:
+        candidate_id = int(payload["candidate_id"])
+        if payload["expiration_utc_time"] is None:
+            # The vote promoted the candidate into the story
+            self.state["candidates"] = [itm for itm in self.state["candidates"] if itm["candidate_id"] != candidate_id]
+            return
+        for candidate in self.state["candidates"]:
+            if candidate["candidate_id"] == candidate_id:
+                candidate["votes"] = payload["votes"]
+                candidate["expiration_utc_time"] = payload["expiration_utc_time"]
+
+    def apply_candidate_expired(self, payload: dict) -> None:
+        candidate_id = int(payload["candidate_id"])
+        self.state["candidates"] = [itm for itm in self.state["candidates"] if itm["candidate_id"] != candidate_id]
+
+    def apply_words_appended(self, payload: dict) -> None:
+        self.state["story"].extend(payload["words"])
+        self.state["story_version"] = payload["story_version"]
+
+    def apply_word_removed(self, payload: dict) -> None:
+        self.state["story"] = [itm for itm in self.state["story"] if itm["word_id"] != payload["word_id"]]
+        self.state["story_version"] = payload["story_version"]
+
+    def apply_word_flag(self, payload: dict) -> None:
+        for word in self.state["story"]:
+            if word["word_id"] == payload["word_id"]:
+                word["flags"] = payload["flags"]
+
+    def apply_user_count(self, payload: dict) -> None:
+        self.state["user_count"] = payload["user_count"]
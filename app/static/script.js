@@ -23,12 +23,31 @@ const ZibbitClient = (function () {
     const startColor = styles.getPropertyValue("--start-color").trim();
     const endColor = styles.getPropertyValue("--end-color").trim();
 
+    // Room to play in, picked with the `room` query parameter (ex. /?room=lobby)
+    const roomId = new URLSearchParams(window.location.search).get("room") || "default";
+    const apiBase = `/rooms/${encodeURIComponent(roomId)}`;
+
     let eventSource = null;
+    let socket = null;
+    // Milliseconds to wait before reopening a WebSocket that was dropped, randomized up to twice as long
+    const WEBSOCKET_RETRY_MILLIS = 1000;
+    // Reconnect delay the server sent in a `retry:` line (ex. while draining for a deploy), used for the next reconnect
+    let serverRetryMillis = null;
+    const textDecoder = new TextDecoder();
+    // Id of the last event received on the WebSocket, and of the last action sent on it
+    let lastEventId = null;
+    let lastActionId = 0;
+    // Action id -> { resolve, reject } of actions still waiting for their ack
+    const pendingActions = new Map();
     let isCooldown = false;
 
     const story = [];
-    const connectedUsers = new Set();
-    let renderInterval = null;
+    // Version of the story currently on screen, and story deltas held back while a resync is in flight
+    let storyVersion = 0;
+    let isResyncingStory = false;
+    const pendingStoryDeltas = [];
+    // Number of players in the room, announced by the server every few seconds when it changes
+    let userCount = 0;
     let candidates = [];
 
     let CANDIDATE_DECAY_SECONDS = null;
@@ -49,51 +68,165 @@ const ZibbitClient = (function () {
     const $candidateInput = document.getElementById("candidate-input");
 
     function init() {
-        setupSSE();
+        if (window.WebSocket) {
+            setupWebSocket();
+        } else {
+            setupSSE();
+        }
         setupCandidateSubmissionForm();
         console.log("Zibbit initialized");
     }
 
-    function setupSSE() {
-        eventSource = new EventSource("/events");
-        eventSource.onerror = () => {
-            console.warn("SSE connection lost. Retrying...");
-        }
-        eventSource.addEventListener("game_state", (e) => {
+    // Event type -> handler of its data, the same whether the event came over the WebSocket or SSE
+    const eventHandlers = {
+        "game_state": (data) => {
             console.log("game state sent!");
-            console.log(JSON.parse(e.data));
-            handleGameStateUpdate(JSON.parse(e.data));
-        });
-        eventSource.addEventListener("game_start", (e) => {
+            console.log(data);
+            handleGameStateUpdate(data);
+        },
+        "game_start": (data) => {
             console.log("game started!");
-            handleGameStartEvent(JSON.parse(e.data));
-        });
-        eventSource.addEventListener("game_end", (e) => {
+            setStoryListData([], 0);
+            handleGameStartEvent(data);
+        },
+        "game_end": (data) => {
             console.log("game ended!");
-            handleCooldownUpdate(JSON.parse(e.data));
-            setStoryListData([]);
+            handleCooldownUpdate(data);
+            setStoryListData([], 0);
             setCandidateListData([]);
-        });
-        eventSource.addEventListener("story_update", (e) => {
-            console.log("story update");
-            setStoryListData(JSON.parse(e.data)["story"]);
-        });
-        eventSource.addEventListener("candidate_update", (e) => {
-           console.log("candidate update");
-           handleAppendCandidate(JSON.parse(e.data));
-        });
-        eventSource.addEventListener("candidate_vote", (e) => {
+        },
+        "words_appended": (data) => {
+            console.log("words appended");
+            handleStoryDelta(data);
+        },
+        "word_removed": (data) => {
+            console.log("word removed");
+            handleStoryDelta(data);
+        },
+        "candidate_update": (data) => {
+            console.log("candidate update");
+            handleAppendCandidate(data);
+        },
+        "candidate_vote": (data) => {
             console.log("candidate vote");
-            handleCandidateVote(JSON.parse(e.data));
-        });
-        eventSource.addEventListener("word_flag", (e) => {
+            handleCandidateVote(data);
+        },
+        "word_flag": (data) => {
             console.log("word flag");
-            handleWordFlag(JSON.parse(e.data));
+            handleWordFlag(data);
+        },
+        "candidate_expired": (data) => {
+            console.log("candidate expired");
+            handleCandidateExpired(data);
+        },
+        // Batched updates, sent instead of the two events above when the server coalesces them
+        "candidate_votes": (data) => {
+            console.log("candidate votes");
+            data["updates"].forEach(applyCandidateVote);
+            renderCandidates();
+        },
+        "word_flags": (data) => {
+            console.log("word flags");
+            data["updates"].forEach(applyWordFlag);
+            renderStory();
+        },
+        "user_count": (data) => {
+            console.log("user count");
+            handleUserCountEvent(data);
+        },
+    };
+
+    function setupSSE() {
+        eventSource = new EventSource(`${apiBase}/events`);
+        eventSource.onerror = () => {
+            console.warn("SSE connection lost. Retrying...");
+        }
+        Object.entries(eventHandlers).forEach(([eventType, handler]) => {
+            eventSource.addEventListener(eventType, (e) => handler(JSON.parse(e.data)));
         });
-        eventSource.addEventListener("user_connections", (e) => {
-           console.log("user connection");
-           handleUserConnectionEvent(JSON.parse(e.data));
+    }
+
+    function setupWebSocket() {
+        const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+        // Lets the server replay what we missed while reconnecting, like EventSource does with Last-Event-ID
+        const query = lastEventId ? `?last_event_id=${encodeURIComponent(lastEventId)}` : "";
+        let wasOpen = false;
+        socket = new WebSocket(`${scheme}://${window.location.host}${apiBase}/ws${query}`);
+        socket.binaryType = "arraybuffer";
+        socket.onopen = () => {
+            wasOpen = true;
+        };
+        socket.onmessage = (e) => {
+            if (typeof e.data === "string") {
+                handleActionAck(JSON.parse(e.data));
+            } else {
+                handleEventFrame(textDecoder.decode(e.data));
+            }
+        };
+        socket.onclose = () => {
+            socket = null;
+            pendingActions.forEach(({ reject }) => reject(new Error("WebSocket closed before the action was acknowledged")));
+            pendingActions.clear();
+            if (!wasOpen) {
+                // Never got through (a proxy without WebSocket support, or /ws turned off), so stay on SSE
+                console.warn("WebSocket unavailable, falling back to SSE");
+                setupSSE();
+                return;
+            }
+            // Without a delay from the server, spread reconnects out so clients dropped together don't return together
+            const retryMillis = serverRetryMillis ?? WEBSOCKET_RETRY_MILLIS * (1 + Math.random());
+            serverRetryMillis = null;
+            console.warn(`WebSocket connection lost. Retrying in ${Math.round(retryMillis)}ms...`);
+            setTimeout(setupWebSocket, retryMillis);
+        };
+    }
+
+    function handleEventFrame(frame) {
+        // Events come in the same frames as on /events: "id: ...", "event: ..." and "data: ..." lines
+        let eventType = null;
+        let data = null;
+        frame.split("\r\n").forEach((line) => {
+            if (line.startsWith("id: ")) {
+                lastEventId = line.slice(4);
+            } else if (line.startsWith("event: ")) {
+                eventType = line.slice(7);
+            } else if (line.startsWith("data: ")) {
+                data = line.slice(6);
+            } else if (line.startsWith("retry: ")) {
+                serverRetryMillis = parseInt(line.slice(7), 10);
+            }
         });
+        const handler = eventHandlers[eventType];
+        if (handler && data !== null) {
+            handler(JSON.parse(data));
+        }
+    }
+
+    function handleActionAck(ack) {
+        const pendingAction = pendingActions.get(ack["ack"]);
+        if (!pendingAction) {
+            console.warn("Unexpected ack", ack);
+            return;
+        }
+        pendingActions.delete(ack["ack"]);
+        pendingAction.resolve(ack);
+    }
+
+    // Sends an action on the WebSocket when it's open, otherwise POSTs it to the route of the same name.
+    // Resolves with the server's answer either way.
+    function sendAction(action, fields) {
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            const id = ++lastActionId;
+            return new Promise((resolve, reject) => {
+                pendingActions.set(id, { resolve, reject });
+                socket.send(JSON.stringify({ id, action, ...fields }));
+            });
+        }
+        return fetch(`${apiBase}/${action}`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify(fields),
+        }).then((response) => response.json());
     }
 
     function setupCandidateSubmissionForm() {
@@ -108,13 +241,7 @@ const ZibbitClient = (function () {
     }
 
     function submitCandidate(value) {
-        fetch("/submit_candidate", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-                "phrase": value
-            }),
-        }).then((response) => response.json())
+        sendAction("submit_candidate", { "phrase": value })
             .then((result) => {
                 console.log(result);
                 $candidateInput.value = "";
@@ -122,23 +249,13 @@ const ZibbitClient = (function () {
     }
 
     function vote(candidateId) {
-        fetch("/vote", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-                "candidate_id": candidateId
-            })
-        }).catch(err => console.error(`Failed to submit vote for id=${candidateId}`, err));
+        sendAction("vote", { "candidate_id": candidateId })
+            .catch(err => console.error(`Failed to submit vote for id=${candidateId}`, err));
     }
 
     function flagWord(wordId) {
-        fetch("/flag_word", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({
-                "word_id": wordId
-            })
-        }).catch(err => console.error(`Failed to submit flag for id=${wordId}`, err));
+        sendAction("flag_word", { "word_id": wordId })
+            .catch(err => console.error(`Failed to submit flag for id=${wordId}`, err));
     }
 
     function getMillisRemaining(candidate) {
@@ -154,6 +271,17 @@ const ZibbitClient = (function () {
     }
 
     function handleCandidateVote(candidateVoteData) {
+        applyCandidateVote(candidateVoteData);
+        renderCandidates();
+    }
+
+    function handleCandidateExpired(candidateExpiredData) {
+        const candidateId = candidateExpiredData["candidate_id"];
+        candidates = candidates.filter((itm) => String(itm["candidate_id"]) !== String(candidateId));
+        renderCandidates();
+    }
+
+    function applyCandidateVote(candidateVoteData) {
         const expirationTime = candidateVoteData["expiration_utc_time"];
         const votes = candidateVoteData["votes"] || [];
         const candidateId = candidateVoteData["candidate_id"];
@@ -168,9 +296,10 @@ const ZibbitClient = (function () {
         } else {
             // The vote crossed the threshold, find winning candidate and remove from list
             const idxOfVotedCandidate = candidates.findIndex((itm) => itm.candidate_id === candidateId);
-            candidates.splice(idxOfVotedCandidate, 1);
+            if (idxOfVotedCandidate !== -1) {
+                candidates.splice(idxOfVotedCandidate, 1);
+            }
         }
-        renderCandidates();
     }
 
     function renderCandidates() {
@@ -199,7 +328,7 @@ const ZibbitClient = (function () {
 
             // Make button send a POST request to vote for this candidate
             voteBtn.addEventListener("click", () => {
-                vote(voteBtn.dataset.candidateId);
+                vote(Number(voteBtn.dataset.candidateId));
             });
 
             const li = document.createElement("li");
@@ -208,42 +337,32 @@ const ZibbitClient = (function () {
             $candidateList.appendChild(li);
         });
 
-        if (renderInterval) clearInterval(renderInterval);
-        renderInterval = setInterval(updateCandidateStyles, 1000);
         updateCandidateStyles();
     }
 
     function updateCandidateStyles() {
-        candidates = candidates.filter((candidate) => {
-            const millis = getMillisRemaining(candidate);
+        // Candidates are removed by the server's candidate_expired event, so there's no timer here:
+        // each button just fades towards the end color over the time its candidate has left
+        candidates.forEach((candidate) => {
             const li = document.getElementById(`candidate-${candidate.candidate_id}`);
-
-            if (!li) return true;
+            if (!li) return;
 
             const btn = li.querySelector(".vote-btn");
-
-            if (millis <= 0) {
-                li.remove();
-                return false;
-            }
-
-            const progress = ((CANDIDATE_DECAY_SECONDS * 1000) - millis) / (CANDIDATE_DECAY_SECONDS * 1000);
-            const color = interpolateColor(startColor, endColor, progress);
-            btn.style.setProperty("background-color", color, "important");
-
-            return true;
+            const millis = Math.max(0, getMillisRemaining(candidate));
+            const progress = Math.min(1, ((CANDIDATE_DECAY_SECONDS * 1000) - millis) / (CANDIDATE_DECAY_SECONDS * 1000));
+            btn.style.setProperty("transition", "none");
+            btn.style.setProperty("background-color", interpolateColor(startColor, endColor, progress), "important");
+            // Flush the starting color before transitioning away from it
+            void btn.offsetWidth;
+            btn.style.setProperty("transition", `background-color ${millis}ms linear`);
+            btn.style.setProperty("background-color", endColor, "important");
         });
-
-        if (candidates.length === 0) {
-            clearInterval(renderInterval);
-            renderInterval = null;
-        }
     }
 
     function handleGameStateUpdate(gameState) {
         console.log("game state is: ");
         console.log(gameState);
-        setConnectedUsersData(gameState["connected_users"]);
+        setUserCount(gameState["user_count"]);
         handleGameConstantsData(gameState["game_constants"]);
         switch (gameState["game_status"]) {
             case "ERROR":
@@ -251,7 +370,7 @@ const ZibbitClient = (function () {
                 break;
             case "COOLDOWN":
                 handleCooldownUpdate(gameState);
-                setStoryListData([]);
+                setStoryListData([], 0);
                 setCandidateListData([]);
                 break;
             case "IN_PLAY":
@@ -260,7 +379,7 @@ const ZibbitClient = (function () {
                     "game_end_utc_time": gameState["game_end_utc_time"],
                     "server_time": gameState["server_time"]
                 });
-                setStoryListData(gameState["story"]);
+                setStoryListData(gameState["story"], gameState["story_version"]);
                 setCandidateListData(gameState["candidates"]);
                 break;
             default:
@@ -269,8 +388,57 @@ const ZibbitClient = (function () {
         }
     }
 
+    function handleStoryDelta(storyDelta) {
+        if (isResyncingStory) {
+            pendingStoryDeltas.push(storyDelta);
+            return;
+        }
+        const version = storyDelta["story_version"];
+        if (version <= storyVersion) {
+            // Already part of the story we have
+            return;
+        }
+        if (version !== storyVersion + 1) {
+            // We missed at least one delta, fetch the whole story once and continue from there
+            pendingStoryDeltas.push(storyDelta);
+            resyncStory();
+            return;
+        }
+
+        if (storyDelta["words"]) {
+            story.push(...storyDelta["words"]);
+        } else {
+            const idxOfRemovedWord = story.findIndex((itm) => itm["word_id"] === storyDelta["word_id"]);
+            if (idxOfRemovedWord !== -1) {
+                story.splice(idxOfRemovedWord, 1);
+            }
+        }
+        storyVersion = version;
+        renderStory();
+    }
+
+    function resyncStory() {
+        console.warn(`Story version gap after ${storyVersion}, resyncing...`);
+        isResyncingStory = true;
+        fetch(`${apiBase}/story`)
+            .then((response) => response.json())
+            .then((result) => {
+                setStoryListData(result["story"], result["story_version"]);
+            }, (error) => console.error("Failed to resync story", error))
+            .finally(() => {
+                isResyncingStory = false;
+                // Replay whatever arrived in the meantime, anything already in the fetched story is skipped
+                pendingStoryDeltas.splice(0).forEach(handleStoryDelta);
+            });
+    }
+
     function handleWordFlag(wordFlagEvent) {
         console.log(wordFlagEvent);
+        applyWordFlag(wordFlagEvent);
+        renderStory();
+    }
+
+    function applyWordFlag(wordFlagEvent) {
         const wordId = wordFlagEvent["word_id"];
         const flags = wordFlagEvent["flags"];
 
@@ -279,25 +447,10 @@ const ZibbitClient = (function () {
                 storyItem.flags = flags;
             }
         });
-
-        renderStory();
     }
 
-    function handleUserConnectionEvent(connectionEvent) {
-        switch (connectionEvent["connection_status"]) {
-            case "user_connected":
-                console.log(`CONNECT: ${connectionEvent["client_ip"]}`);
-                connectedUsers.add(connectionEvent["client_ip"]);
-                break;
-            case "user_disconnected":
-                console.log(`DISCONNECT: ${connectionEvent["client_ip"]}`);
-                connectedUsers.delete(connectionEvent["client_ip"]);
-                break;
-            default:
-                alert("UNKNOWN: check connection sse data...")
-                break;
-        }
-        renderUserConnections();
+    function handleUserCountEvent(userCountEvent) {
+        setUserCount(userCountEvent["user_count"]);
     }
 
     function startCountdown(utcTimestamp, serverTimestamp, timerElement) {
@@ -355,7 +508,7 @@ const ZibbitClient = (function () {
     }
 
     function renderUserConnections() {
-        $connectedUsers.textContent = `x${connectedUsers.size}`;
+        $connectedUsers.textContent = `x${userCount}`;
     }
 
     function renderStory() {
@@ -374,7 +527,7 @@ const ZibbitClient = (function () {
             wordElement.id = `word-${wordId}`;
 
             wordElement.addEventListener("click", () => {
-                flagWord(wordElement.dataset.wordId);
+                flagWord(Number(wordElement.dataset.wordId));
             });
 
             if (numFlags > 0) {
@@ -395,18 +548,16 @@ const ZibbitClient = (function () {
         renderCandidates();
     }
 
-    function setStoryListData(storyListData) {
+    function setStoryListData(storyListData, version) {
         console.log(storyListData);
+        storyVersion = version || 0;
         story.length = 0;
         story.push(...(storyListData || []));
         renderStory();
     }
 
-    function setConnectedUsersData(connectedUsersListData) {
-        connectedUsers.clear();
-        connectedUsersListData.forEach((clientIp) => {
-            connectedUsers.add(clientIp);
-        });
+    function setUserCount(count) {
+        userCount = count;
         renderUserConnections();
     }
 
@@ -0,0 +1,115 @@
+import fcntl
+import json
+import os
+import struct
+import zlib
+
+# Segment files are rolled over once they grow past this size
+ARCHIVE_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Index entry of one story: segment number, offset in the segment and length of its compressed record
+INDEX_ENTRY = struct.Struct("<IQI")
+INDEX_FILE_NAME = "index"
+# Segments are named by number, ex. segment-000001
+SEGMENT_FILE_NAME = "segment-{:06d}"
+
+
+class StoryArchive:
+    """
+    Append-only archive of finished stories on local disk, one directory per room:
+
+    segment-NNNNNN: zlib-compressed JSON records, one per story, back to back
+    index:          a fixed-size INDEX_ENTRY per story, so story N's entry sits at N * INDEX_ENTRY.size
+
+    Story ids are positions in the index, starting at 0. Reads are positional (pread) on the index and
+    segments, so serving any story or page touches only those bytes, and never Redis. Appends take a file
+    lock on the index, so workers sharing the directory can't interleave their records. Records are written
+    before their index entry, and a torn index entry is cut off by the next append, so a crash mid-append
+    loses at most that story.
+
+    Every method does blocking file I/O, run them off the event loop.
+    """
+
+    def __init__(self, root_dir: str, segment_max_bytes: int = ARCHIVE_SEGMENT_MAX_BYTES):
+        self.root_dir = root_dir
+        self.segment_max_bytes = segment_max_bytes
+
+    def room_dir(self, room_id: str) -> str:
+        # Room ids are restricted to ROOM_ID_PATTERN, so they're safe as directory names
+        return os.path.join(self.root_dir, room_id)
+
+    def append(self, room_id: str, story: dict) -> int:
+        """Archives a finished story, returns its id."""
+        room_dir = self.room_dir(room_id)
+        os.makedirs(room_dir, exist_ok=True)
+        record = zlib.compress(json.dumps(story, separators=(",", ":")).encode())
+        index_fd = os.open(os.path.join(room_dir, INDEX_FILE_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(index_fd, fcntl.LOCK_EX)
+            index_size = os.fstat(index_fd).st_size
+            story_id, torn_bytes = divmod(index_size, INDEX_ENTRY.size)
+            if torn_bytes:
+                os.ftruncate(index_fd, story_id * INDEX_ENTRY.size)
+
+            segment = 1
+            if story_id:
+                segment, last_offset, last_length = INDEX_ENTRY.unpack(
+                    os.pread(index_fd, INDEX_ENTRY.size, (story_id - 1) * INDEX_ENTRY.size))
+                if last_offset + last_length + len(record) > self.segment_max_bytes:
+                    segment += 1
+
+            segment_fd = os.open(os.path.join(room_dir, SEGMENT_FILE_NAME.format(segment)),
+                                 os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                offset = os.fstat(segment_fd).st_size
+                os.write(segment_fd, record)
+                os.fsync(segment_fd)
+            finally:
+                os.close(segment_fd)
+            os.pwrite(index_fd, INDEX_ENTRY.pack(segment, offset, len(record)), story_id * INDEX_ENTRY.size)
+            os.fsync(index_fd)
+            return story_id
+        finally:
+            os.close(index_fd)
+
+    def count(self, room_id: str) -> int:
+        try:
+            return os.stat(os.path.join(self.room_dir(room_id), INDEX_FILE_NAME)).st_size // INDEX_ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    def read(self, room_id: str, story_id: int) -> dict | None:
+        stories = self.read_range(room_id, story_id, story_id + 1)
+        return stories[0] if stories else None
+
+    def read_page(self, room_id: str, before: int | None, limit: int) -> tuple[list[dict], int | None]:
+        """
+        Returns up to `limit` stories older than story `before` (or the latest ones), newest first,
+        and the `before` of the next page (None on the last one).
+        """
+        count = self.count(room_id)
+        end = count if before is None else max(0, min(before, count))
+        start = max(0, end - limit)
+        stories = self.read_range(room_id, start, end)[::-1]
+        return stories, start if start > 0 else None
+
+    def read_range(self, room_id: str, start: int, end: int) -> list[dict]:
+        """Returns stories `start` up to `end` (excluded), in story id order, each with its "story_id"."""
+        room_dir = self.room_dir(room_id)
+        end = min(end, self.count(room_id))
+        if start < 0 or start >= end:
+            return []
+        with open(os.path.join(room_dir, INDEX_FILE_NAME), "rb") as index_file:
+            entries = os.pread(index_file.fileno(), (end - start) * INDEX_ENTRY.size, start * INDEX_ENTRY.size)
+
+        stories = []
+        segment_files = {}
+        try:
+            for story_id, (segment, offset, length) in enumerate(INDEX_ENTRY.iter_unpack(entries), start):
+                if segment not in segment_files:
+                    segment_files[segment] = open(os.path.join(room_dir, SEGMENT_FILE_NAME.format(segment)), "rb")
+                record = os.pread(segment_files[segment].fileno(), length, offset)
+                stories.append({"story_id": story_id, **json.loads(zlib.decompress(record))})
+        finally:
+            for segment_file in segment_files.values():
+                segment_file.close()
+        return stories
@@ -0,0 +1,45 @@
+"""
+Leveled, structured logging for the app's modules. Log calls pass a short event name as the message and
+their details as `extra` fields, ex. logger.info("room_started", extra={"room": room_id}), so lines can be
+filtered and parsed. Per-request logs are at DEBUG, so the default level keeps them (and their formatting)
+off the hot path entirely.
+"""
+import json
+import logging
+import sys
+
+# Attributes every LogRecord has, anything else on a record came in through `extra`
+STANDARD_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, or as `<time> <level> <logger> <event> key=value ...`."""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__()
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {name: value for name, value in vars(record).items() if name not in STANDARD_RECORD_ATTRIBUTES}
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        if self.json_output:
+            return json.dumps({
+                "time": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "event": record.getMessage(),
+                **fields
+            }, default=str)
+        details = " ".join(f"{name}={value!r}" if isinstance(value, str) and " " in value else f"{name}={value}"
+                           for name, value in fields.items())
+        return f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()} {details}".rstrip()
+
+
+def configure_logging(level: str = "INFO", log_format: str = "text") -> None:
+    """Sends the app's logs to stderr at `level`, as "text" or "json" lines."""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter(json_output=log_format == "json"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
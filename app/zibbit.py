@@ -1,10 +1,22 @@
-import json
-from datetime import datetime, UTC, timedelta
+import time
 import asyncio
-import redis.asyncio as redis
+import logging
+
+from game_store import (
+    GameStore,
+    new_worker_id,
+    DEFAULT_ROOM_ID,
+    ROOM_ID_PATTERN,
+    GAME_STATUS_KEY,
+    EVENT_GAME_START_CHANNEL,
+    EVENT_GAME_END_CHANNEL
+)
+from redis_store import RedisGameStore
+from story_archive import StoryArchive
+from metrics import timed
 
 """
-Story keys: [
+Story (read back in word_id order from the story_words index, each word stored in its own hash + flags set): [
     {
         "word_id": 2,
         "word": "the",
@@ -14,7 +26,7 @@ Story keys: [
     ...
 ]
 
-Candidates: [
+Candidates (each stored in its own hash + votes set, both expiring with the candidate): [
     {
         "candidate_id": 3,
         "phrase": "monkey went to",
@@ -26,45 +38,12 @@ Candidates: [
 ]
 """
 
-# Game status (ex. COOLDOWN or IN_PLAY)
-GAME_STATUS_KEY = "game_status"
-# Stores current time remaining in game cooldown timer
-GAME_IN_PLAY_TIMER_SECONDS = "game_in_play_timer"
-# Stores current time remaining in game cooldown timer
-GAME_COOLDOWN_TIMER_SECONDS = "game_cooldown_timer"
-# Stores the story as a list
-STORY_KEY = "story"
-# Prefix for phrases that are in cooldown period
-COOLDOWN_PHRASES_KEY_PREFIX = "cooldown_phrases"
-# Prefix for candidate phrases
-CANDIDATES_KEY_PREFIX = "candidates"
-CANDIDATES_VOTES_KEY_PREFIX = "candidate_votes"
-# Predix for users
-USER_RATE_LIMIT_PREFIX = "user"
-# Stores the game ttl
-GAME_TTL_KEY = "game_ttl"
-# Prefix for storing story words to flag counter
-STORY_FLAG_KEY_PREFIX = "story_flag"
-# Stores the incrementing ids for candidates
-CANDIDATE_AUTOINCR_KEY = "candidate_autoincr"
-# Stores the incrementing ids for words
-WORD_AUTOINCR_KEY = "word_autoincr"
-# Stores the set of connected users
-CONNECTED_USERS_KEY = "connected_users"
-
-# Denotes the channel prefix to subscribe to for game updates
-GAME_EVENTS_CHANNEL_PREFIX = "game_events"
-# Channels that store pub/sub for game events
-EVENT_GAME_START_CHANNEL = "game_start"
-EVENT_GAME_END_CHANNEL = "game_end"
-EVENT_STORY_UPDATE_CHANNEL = "story_update"
-EVENT_CANDIDATE_UPDATE_CHANNEL = "candidate_update"
-EVENT_CANDIDATE_VOTE_CHANNEL = "candidate_vote"
-EVENT_WORD_FLAG_CHANNEL = "word_flag"
-EVENT_USER_CONNECTIONS = "user_connections"
-
 # Length of a game
 GAME_LENGTH_SECONDS = 120
+# How long the timer leader lease lasts without being renewed, ie. how quickly another worker takes over
+TIMER_LEADER_LEASE_SECONDS = 5
+# How often every worker tries to acquire (or the leader renews) the timer lease and checks the game phase
+TIMER_TICK_SECONDS = 1
 # Length of cooldown between games
 GAME_COOLDOWN_SECONDS = 10
 # TTL for candidate
@@ -77,6 +56,16 @@ CANDIDATE_SUBMISSION_COOLDOWN_SECONDS = 20
 CANDIDATE_VOTE_THRESHOLD = 3
 # Number of unique word flags required for a word to be removed from the story
 WORD_FLAG_THRESHOLD = 3
+# How long a single blocking read on the event log waits for new events
+GAME_EVENTS_STREAM_BLOCK_MILLIS = 5000
+# How often each worker reports its number of open connections to a room
+PRESENCE_HEARTBEAT_SECONDS = 5
+# How long a worker's report counts without a newer one, ie. how long a dead worker's clients are still counted
+PRESENCE_TTL_SECONDS = 15
+# Minimum time between two user count announcements to a room's clients
+PRESENCE_BROADCAST_SECONDS = 5
+
+logger = logging.getLogger(__name__)
 
 
 async def validate_phrase(inp: str):
@@ -87,82 +76,218 @@ async def validate_phrase(inp: str):
 
 
 class ZibbitGame:
+    """
+    The game rules of a single room. State and events live in a GameStore: Redis by default,
+    or a MemoryGameStore for single process deployments.
+    """
+
+    def __init__(self, redis_host="redis", redis_port=6379, redis_user="user", redis_pass="pass", event_log=False,
+                 room_id=DEFAULT_ROOM_ID, store: GameStore | None = None, archive: StoryArchive | None = None):
+        # Identifies this worker when it holds the timer leader lease, in the room's presence counts
+        # and in the requests the store records in rate limit windows
+        self.worker_id = new_worker_id()
+        self.store = store or RedisGameStore(
+            redis_host=redis_host,
+            redis_port=redis_port,
+            redis_user=redis_user,
+            redis_pass=redis_pass,
+            event_log=event_log,
+            room_id=room_id,
+            worker_id=self.worker_id)
+        # Where finished stories are kept, if anywhere
+        self.archive = archive
+        # When the timer leader announces the user count next
+        self.next_presence_broadcast = 0
+
+
+    @property
+    def room_id(self) -> str:
+        return self.store.room_id
+
+    @property
+    def event_log(self) -> bool:
+        # When enabled, events are kept in a capped log instead of plain pub/sub so clients can resume
+        return self.store.event_log
+
+    def for_room(self, room_id: str) -> "ZibbitGame":
+        """Returns the game of another room, sharing this game's store connections and archive."""
+        room = ZibbitGame(store=self.store.for_room(room_id), archive=self.archive)
+        room.worker_id = self.worker_id
+        return room
+
+    async def presence_loop(self, count_connections):
+        # Every worker reports how many clients it's streaming the room to, `count_connections` tells it.
+        # Reports run out on their own, so a worker that dies stops being counted without any cleanup.
+        while True:
+            try:
+                await self.heartbeat_presence(count_connections())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("presence_heartbeat_failed", extra={"room": self.room_id})
+            await asyncio.sleep(PRESENCE_HEARTBEAT_SECONDS)
 
-    def __init__(self, redis_host="redis", redis_port=6379, redis_user="user", redis_pass="pass"):
-        self.game_status = "COOLDOWN"
-        self.game_start_utc_time = None
-        self.game_end_utc_time = None
-        self.next_game_start_utc_time = None
-        self.redis = redis.StrictRedis(
-            host=redis_host,
-            port=redis_port,
-            decode_responses=True,
-            username=redis_user,
-            password=redis_pass)
-        self.pubsub_redis = redis.StrictRedis(
-            host=redis_host,
-            port=redis_port,
-            decode_responses=True,
-            username=redis_user,
-            password=redis_pass)
-
-
-    def pubsub(self):
-        return self.pubsub_redis.pubsub()
-
-    async def register_user(self, client_ip):
-        print(f"registering {client_ip}")
-        await self.redis.sadd(CONNECTED_USERS_KEY, client_ip)
-        await self.publish_event(EVENT_USER_CONNECTIONS, {
-            "connection_status": "user_connected",
-            "client_ip": client_ip
-        })
-
-    async def deregister_user(self, client_ip):
-        try:
-            print(f"de-registering {client_ip}")
-            await self.redis.srem(CONNECTED_USERS_KEY, client_ip)
-            print(f"Removed {client_ip} from CONNECTED_USERS_KEY")
-            await self.publish_event(EVENT_USER_CONNECTIONS, {
-                "connection_status": "user_disconnected",
-                "client_ip": client_ip
-            })
-            print("Published user_disconnected event")
-        except Exception as e:
-            print(f"Error in deregister_user: {e}")
+    async def heartbeat_presence(self, connections: int) -> None:
+        await self.store.heartbeat_presence(self.worker_id, connections, time.time(), PRESENCE_TTL_SECONDS)
 
     async def timer_loop(self):
+        # Every worker runs this loop, but only the one holding the leader lease moves the game along
+        # and expires candidates. The phase timestamps and candidate expirations live in the store,
+        # so a new leader picks up where the old one left it.
         while True:
-            # On server startup, the first phase should be cooldown
+            sleep_seconds = TIMER_TICK_SECONDS
+            try:
+                if await self.acquire_timer_lease():
+                    seconds_until_next_phase = await self.advance_game_phase()
+                    seconds_until_next_expiry = await self.expire_candidates()
+                    seconds_until_next_presence = await self.broadcast_presence()
+                    # New candidates expire at least CANDIDATE_DECAY_SECONDS out, so waking up at the next
+                    # known expiration (or tick) never misses one
+                    sleep_seconds = max(0, min(sleep_seconds, seconds_until_next_phase, seconds_until_next_expiry,
+                                               seconds_until_next_presence))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("timer_loop_failed", extra={"room": self.room_id})
+            await asyncio.sleep(sleep_seconds)
+
+
+    @timed
+    async def acquire_timer_lease(self) -> bool:
+        return await self.store.acquire_timer_lease(self.worker_id, TIMER_LEADER_LEASE_SECONDS)
+
+
+    async def release_timer_lease(self) -> None:
+        # Lets another worker take over right away instead of waiting for the lease to run out
+        await self.store.release_timer_lease(self.worker_id)
+
+
+    @timed
+    async def advance_game_phase(self) -> float:
+        """Starts or ends the game if the current phase is over, returns the seconds left in the (new) phase."""
+        game_phase = self.parse_game_phase(await self.store.get_game_phase())
+        now = time.time()
+        if game_phase[GAME_STATUS_KEY] == "IN_PLAY":
+            if now < game_phase["game_end_utc_time"]:
+                return game_phase["game_end_utc_time"] - now
             await self.handle_end_game()
-            # Start the cooldown timer
-            await asyncio.sleep(GAME_COOLDOWN_SECONDS)
-
-            # Call the function to set start game data
+            return GAME_COOLDOWN_SECONDS
+        if game_phase[GAME_STATUS_KEY] == "COOLDOWN":
+            if now < game_phase["next_game_start_utc_time"]:
+                return game_phase["next_game_start_utc_time"] - now
             await self.handle_start_game()
-            # Start the game timer
-            await asyncio.sleep(GAME_LENGTH_SECONDS)
+            return GAME_LENGTH_SECONDS
+        # On a fresh store, the first phase should be cooldown
+        await self.handle_end_game()
+        return GAME_COOLDOWN_SECONDS
+
+
+    @timed
+    async def expire_candidates(self) -> float:
+        """Retires the candidates that have expired, returns the seconds until the next one does."""
+        next_expiration = await self.store.expire_candidates(self.worker_id, time.time())
+        if next_expiration is None:
+            return TIMER_TICK_SECONDS
+        return next_expiration - time.time()
+
+
+    @timed
+    async def broadcast_presence(self) -> float:
+        """
+        Announces the room's user count once it's due, if it changed since the last announcement.
+        Returns the seconds until the next one is due.
+        """
+        now = time.time()
+        if now < self.next_presence_broadcast:
+            return self.next_presence_broadcast - now
+        await self.store.broadcast_presence(self.worker_id, now)
+        self.next_presence_broadcast = now + PRESENCE_BROADCAST_SECONDS
+        return PRESENCE_BROADCAST_SECONDS
+
+
+    @staticmethod
+    def parse_game_phase(game_phase) -> dict:
+        game_status, game_start_utc_time, game_end_utc_time, next_game_start_utc_time = game_phase
+        return {
+            GAME_STATUS_KEY: game_status or "ERROR",
+            "game_start_utc_time": float(game_start_utc_time) if game_start_utc_time else None,
+            "game_end_utc_time": float(game_end_utc_time) if game_end_utc_time else None,
+            "next_game_start_utc_time": float(next_game_start_utc_time) if next_game_start_utc_time else None
+        }
+
+
+    async def set_game_phase(self, event_type: str, game_phase: dict) -> bool:
+        """Stores the new phase and announces it, unless this worker has lost the timer leader lease."""
+        return await self.store.set_game_phase(self.worker_id, event_type, game_phase)
 
 
-    async def publish_event(self, event_type: str, payload: dict) -> None:
-        await self.redis.publish(f"{GAME_EVENTS_CHANNEL_PREFIX}:{event_type}", json.dumps(payload))
+    @timed
+    async def hit_rate_limit(self, action: str, client_ip: str, limit: int, window_seconds: float) -> float:
+        """Records a request against the client's sliding window, returns 0 if it's allowed or the seconds to wait."""
+        return await self.store.hit_rate_limit(action, client_ip, limit, window_seconds, time.time())
 
 
+    async def read_event_log(self, last_event_id: str, block_millis: int = GAME_EVENTS_STREAM_BLOCK_MILLIS):
+        """Blocks until events newer than `last_event_id` are logged, returns [(id, event_type, data, published_at), ...]."""
+        return await self.store.read_event_log(last_event_id, block_millis)
+
+
+    async def get_latest_event_id(self) -> str:
+        return await self.store.get_latest_event_id()
+
+
+    @timed
+    async def get_events_since(self, last_event_id: str):
+        """
+        Returns (seq of `last_event_id`, [(id, event_type, data, seq), ...] for every event logged after it),
+        or None when the log no longer has `last_event_id` and the caller needs a full snapshot.
+        """
+        return await self.store.get_events_since(last_event_id)
+
+
+    @timed
+    async def get_story(self):
+        # Read the story and its version together so the version describes exactly these words
+        story_version, word_items = await self.store.read_story()
+        return {
+            "story": self.parse_story_words(word_items),
+            "story_version": story_version
+        }
+
+
+    @staticmethod
+    def parse_story_words(word_items) -> list[dict]:
+        return [{
+            "word_id": int(word_id),
+            "word": word,
+            "flags": flags,
+            "creator": creator
+        } for word_id, word, creator, flags in word_items]
+
+
+    @timed
     async def get_game_state(self):
-        word_items = await self.redis.lrange(STORY_KEY, 0, -1)
-        candidates_keys = await self.redis.keys(f"{CANDIDATES_KEY_PREFIX}:*")
-        candidate_items = await self.redis.mget(candidates_keys)
-        game_status = await self.redis.get(GAME_STATUS_KEY) or "ERROR"
-        connected_users = await self.redis.smembers(CONNECTED_USERS_KEY)
+        """
+        Reads the whole game at once, along with the sequence number of the last event it reflects
+        ("seq") and, in event log mode, that event's log id ("last_event_id").
+        """
+        seq, last_event_id, game_phase, story_version, word_items, candidate_items, user_count = \
+            await self.store.read_game_state()
 
         return {
-            "story": [json.loads(itm) for itm in word_items],
-            "candidates": [json.loads(itm) for itm in candidate_items],
-            "game_status": game_status,
-            "game_start_utc_time": self.game_start_utc_time,
-            "game_end_utc_time": self.game_end_utc_time,
-            "next_game_start_utc_time": self.next_game_start_utc_time,
-            "connected_users": [*connected_users],
+            "seq": seq,
+            "last_event_id": last_event_id,
+            "story": self.parse_story_words(word_items),
+            "story_version": story_version,
+            "candidates": [{
+                "candidate_id": int(candidate_id),
+                "phrase": phrase,
+                "votes": votes,
+                "creator": creator,
+                "expiration_utc_time": float(expiration_utc_time)
+            } for candidate_id, phrase, creator, expiration_utc_time, votes in candidate_items],
+            **self.parse_game_phase(game_phase),
+            "user_count": user_count,
             "game_constants": {
                 "CANDIDATE_DECAY_SECONDS": CANDIDATE_DECAY_SECONDS,
                 "CANDIDATE_VOTE_THRESHOLD": CANDIDATE_VOTE_THRESHOLD,
@@ -171,208 +296,82 @@ class ZibbitGame:
         }
 
 
+    @timed
     async def handle_start_game(self) -> None:
-        # Handle clearing previous game state data from Redis
-        await self.clear_redis()
-        await self.redis.set(GAME_STATUS_KEY, "IN_PLAY")
-
-        # Set the game state data to a new game
-        now = datetime.now(UTC)
-        self.game_start_utc_time = now.timestamp()
-        self.game_end_utc_time = (now + timedelta(seconds=GAME_LENGTH_SECONDS)).timestamp()
-        self.next_game_start_utc_time = None
-
-        await self.publish_event(EVENT_GAME_START_CHANNEL, {
+        # Clearing the previous game and starting the new one is fenced by the lease like any other transition,
+        # so a worker that just lost it can't wipe the game the new leader started
+        now = time.time()
+        await self.store.start_game(self.worker_id, EVENT_GAME_START_CHANNEL, {
             GAME_STATUS_KEY: "IN_PLAY",
-            "game_start_utc_time": self.game_start_utc_time,
-            "game_end_utc_time": self.game_end_utc_time
+            "game_start_utc_time": now,
+            "game_end_utc_time": now + GAME_LENGTH_SECONDS
         })
 
 
+    @timed
     async def handle_end_game(self) -> None:
-        await self.redis.set(GAME_STATUS_KEY, "COOLDOWN")
-        now = datetime.now(UTC)
-        self.next_game_start_utc_time = (now + timedelta(seconds=GAME_COOLDOWN_SECONDS)).timestamp()
-        self.game_start_utc_time = None
-        self.game_end_utc_time = None
-
-        await self.publish_event(EVENT_GAME_END_CHANNEL, {
+        finished_game = self.parse_game_phase(await self.store.get_game_phase())
+        ended = await self.set_game_phase(EVENT_GAME_END_CHANNEL, {
             GAME_STATUS_KEY: "COOLDOWN",
-            "next_game_start_utc_time": self.next_game_start_utc_time
+            "next_game_start_utc_time": time.time() + GAME_COOLDOWN_SECONDS
         })
+        # Only the worker that actually ended the game archives it, and the story stays put until the next start
+        if ended and self.archive and finished_game[GAME_STATUS_KEY] == "IN_PLAY":
+            await self.archive_story(finished_game)
 
 
-    async def clear_redis(self) -> None:
-        # Clear story
-        await self.redis.delete(STORY_KEY)
-        # Clear candidates
-        candidates = await self.redis.keys(f"{CANDIDATES_KEY_PREFIX}:*")
-        if candidates:
-            await self.redis.delete(*candidates)
-        # Clear candidates cooldown set
-        candidates_cooldown = await self.redis.keys(f"{COOLDOWN_PHRASES_KEY_PREFIX}:*")
-        if candidates_cooldown:
-            await self.redis.delete(*candidates_cooldown)
-        # Reset autoincrement ids back to 1
-        await self.redis.set(CANDIDATE_AUTOINCR_KEY, 1)
-        await self.redis.set(WORD_AUTOINCR_KEY, 1)
-
-    async def get_autoincr_candidate_ids(self, amount = 1) -> list[int]:
-        return await self.autoincr_id_wrapper(CANDIDATE_AUTOINCR_KEY, amount)
-
-    async def get_autoincr_word_ids(self, amount = 1) -> list[int]:
-        return await self.autoincr_id_wrapper(WORD_AUTOINCR_KEY, amount)
-
-    async def autoincr_id_wrapper(self, redis_key, amount = 1) -> list[int]:
-        ending_key = await self.redis.incr(redis_key, amount=amount)
-        starting_key = ending_key - amount
-        return list(range(starting_key + 1, ending_key + 1))
+    @timed
+    async def archive_story(self, finished_game: dict) -> None:
+        story = await self.get_story()
+        if not story["story"]:
+            return
+        try:
+            story_id = await asyncio.to_thread(self.archive.append, self.room_id, {
+                "room_id": self.room_id,
+                "game_start_utc_time": finished_game["game_start_utc_time"],
+                "game_end_utc_time": finished_game["game_end_utc_time"],
+                "story_version": story["story_version"],
+                "words": [{"word": itm["word"], "creator": itm["creator"]} for itm in story["story"]]
+            })
+            logger.info("story_archived", extra={"room": self.room_id, "story_id": story_id})
+        except OSError:
+            # Losing a story from the history shouldn't stop the game
+            logger.exception("story_archive_failed", extra={"room": self.room_id})
+
 
+    async def clear_game(self) -> None:
+        await self.store.clear_game()
+
+    @timed
     async def handle_phrase_submission(self, client_ip: str, phrase: str) -> bool:
         phrase = phrase.strip().lower()
         await validate_phrase(phrase)
-        # Check if phrase has a cooldown submission time, if so reject it
-        cooldown_key = f"{COOLDOWN_PHRASES_KEY_PREFIX}:{phrase}"
-        if await self.redis.get(cooldown_key):
-            return False
-        else:
-            candidate_id = (await self.get_autoincr_candidate_ids())[0]
-            candidate_key = f"{CANDIDATES_KEY_PREFIX}:{candidate_id}"
-            candidate_item = {
-                "candidate_id": candidate_id,
-                "phrase": phrase,
-                "votes": [],
-                "creator": client_ip,
-                "expiration_utc_time": (datetime.now() + timedelta(seconds=CANDIDATE_DECAY_SECONDS)).timestamp()
-            }
-            await self.redis.setex(candidate_key, CANDIDATE_DECAY_SECONDS, json.dumps(candidate_item))
-            await self.redis.setex(cooldown_key, CANDIDATE_SUBMISSION_COOLDOWN_SECONDS, "cooldown")
-            await self.publish_event(EVENT_CANDIDATE_UPDATE_CHANNEL, candidate_item)
-            return True
-
-
+        # The cooldown check, candidate creation and its event happen atomically
+        candidate_id = await self.store.submit_candidate(
+            phrase,
+            client_ip,
+            time.time(),
+            CANDIDATE_DECAY_SECONDS,
+            CANDIDATE_SUBMISSION_COOLDOWN_SECONDS)
+        # No candidate id means the phrase is still in its submission cooldown
+        return candidate_id is not None
+
+
+    @timed
     async def handle_vote(self, client_ip: str, candidate_id: int) -> bool:
-        # Check if phrase is actually a candidate
-        candidate_key = f"{CANDIDATES_KEY_PREFIX}:{candidate_id}"
-        candidate_info = await self.redis.get(candidate_key)
-        if not candidate_info:
-            return False
-        else:
-            candidate_info = json.loads(candidate_info)
-            candidate_phrase, candidate_votes, creator = candidate_info['phrase'], candidate_info['votes'], candidate_info['creator']
-            if client_ip == creator:
-                # Can't vote for your own phrase
-                return False
-            cooldown_key = f"{COOLDOWN_PHRASES_KEY_PREFIX}:{candidate_phrase}"
-            if client_ip in candidate_votes:
-                # If client already voted for this, voting again should un-vote
-                updated_candidate_votes = list(filter(lambda ip_addr: ip_addr != client_ip, candidate_votes))
-                vote_added = False
-            else:
-                # Reset candidate cooldown time
-                await self.redis.setex(cooldown_key, CANDIDATE_SUBMISSION_COOLDOWN_SECONDS, "cooldown")
-                updated_candidate_votes = [*candidate_votes, client_ip]
-                vote_added = True
-
-            if len(updated_candidate_votes) >= CANDIDATE_VOTE_THRESHOLD:
-                await self.redis.delete(candidate_key)
-                await self.publish_event(EVENT_CANDIDATE_VOTE_CHANNEL, {
-                    "candidate_id": candidate_id,
-                    "phrase": candidate_phrase,
-                    "votes": updated_candidate_votes,
-                    "creator": creator,
-                    "expiration_utc_time": None
-                })
-                await self.handle_insert_phrase_to_story(candidate_info)
-                return True
-            else:
-
-                remaining_ttl = await self.redis.ttl(candidate_key)
-                if vote_added:
-                    # Votes keep the candidate alive for longer
-                    updated_ttl = remaining_ttl + len(updated_candidate_votes)
-                    new_expiration_utc_time = (datetime.now() + timedelta(seconds=updated_ttl)).timestamp()
-                else:
-                    updated_ttl = remaining_ttl
-                    new_expiration_utc_time = (datetime.now() + timedelta(seconds=updated_ttl)).timestamp()
-
-                await self.redis.setex(candidate_key, updated_ttl, json.dumps({
-                    "candidate_id": candidate_id,
-                    "phrase": candidate_phrase,
-                    "votes": updated_candidate_votes,
-                    "creator": creator,
-                    "expiration_utc_time": new_expiration_utc_time
-                }))
-                await self.publish_event(EVENT_CANDIDATE_VOTE_CHANNEL, {
-                    "candidate_id": candidate_id,
-                    "phrase": candidate_phrase,
-                    "votes": updated_candidate_votes,
-                    "creator": creator,
-                    "expiration_utc_time": new_expiration_utc_time
-                })
-                return True
-
-
-    async def send_full_story(self):
-        full_story = await self.redis.lrange(STORY_KEY, 0, -1)
-        word_items = [json.loads(itm) for itm in full_story]
-        await self.publish_event(EVENT_STORY_UPDATE_CHANNEL, {
-            "story": word_items
-        })
-
-
-    async def handle_insert_phrase_to_story(self, candidate_info: dict):
-        # Tokenize phrase and insert
-        candidate_phrase, creator = candidate_info['phrase'], candidate_info['creator']
-        words = candidate_phrase.split(" ")
-        next_word_ids = await self.get_autoincr_word_ids(len(words))
-        word_items = [json.dumps({
-            "word_id": next_word_ids[idx],
-            "word": w,
-            "flags": [],
-            "creator": creator
-        }) for idx, w in enumerate(words)]
-        await self.redis.rpush(STORY_KEY, *word_items)
-
-        # Send single update
-        await self.send_full_story()
+        # Vote toggle, TTL extension, promotion into the story and the events all happen atomically
+        result = await self.store.vote(
+            candidate_id,
+            client_ip,
+            time.time(),
+            CANDIDATE_VOTE_THRESHOLD,
+            CANDIDATE_SUBMISSION_COOLDOWN_SECONDS)
+        return result is not None
 
 
+    @timed
     async def handle_word_flag(self, client_ip: str, word_id: int) -> bool:
-        # Check if word has already been flagged
-        full_story = await self.redis.lrange(STORY_KEY, 0, -1)
-        story_items = [json.loads(itm) for itm in full_story]
-        if not (word_id in [itm["word_id"] for itm in story_items]):
-            return False
-        word_item = list(filter(lambda itm: itm["word_id"] == word_id, story_items))[0]
-        word_flags = word_item["flags"]
-        if client_ip in word_flags:
-            # If client already flagged the word, remove the client's ip from the flag list (ie. un-flag it)
-            updated_word_flags = list(filter(lambda flagged_ip: flagged_ip != client_ip, word_flags))
-        else:
-            updated_word_flags = [*word_flags, client_ip]
-
-        if len(updated_word_flags) >= WORD_FLAG_THRESHOLD:
-            # Remove the word from the story
-            new_story = list(filter(lambda itm: itm["word_id"] != word_id, story_items))
-            await self.redis.delete(STORY_KEY)
-            if new_story:
-                await self.redis.rpush(STORY_KEY, *[json.dumps(story_itm) for story_itm in new_story])
-            # Send single update
-            await self.send_full_story()
-        else:
-            # Update the word item in the story
-            new_story = [word_item if word_item["word_id"] != word_id else {
-                **word_item,
-                "flags": updated_word_flags
-            } for word_item in story_items]
-            await self.redis.delete(STORY_KEY)
-            if new_story:
-                await self.redis.rpush(STORY_KEY, *[json.dumps(story_itm) for story_itm in new_story])
-            await self.publish_event(EVENT_WORD_FLAG_CHANNEL, {
-                "word_id": word_id,
-                "flags": updated_word_flags
-            })
-        return True
-
-
+        # Flagging again un-flags, and the word is cut from the story once it hits the threshold.
+        # Only this word is touched, atomically, so concurrent inserts and flags can't clobber each other.
+        result = await self.store.flag_word(word_id, client_ip, WORD_FLAG_THRESHOLD)
+        return result is not None
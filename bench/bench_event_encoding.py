@@ -0,0 +1,69 @@
+"""
+Compares the per-client cost of turning one published game event into an SSE frame.
+
+before: every subscriber decodes the payload, merges in server_time and re-encodes it
+after:  the hub encodes the frame once per worker and every subscriber reuses the bytes
+
+Usage: python bench/bench_event_encoding.py [--clients 1000] [--events 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from sse_starlette.sse import ServerSentEvent  # noqa: E402
+from event_hub import encode_event_frame  # noqa: E402
+
+SAMPLE_PAYLOAD = {
+    "candidate_id": 42,
+    "phrase": "went over the hill",
+    "votes": ["10.0.0.1", "10.0.0.2"],
+    "creator": "10.0.0.3",
+    "expiration_utc_time": 1760000000.123,
+}
+
+
+def per_client_encoding(channel: str, data: str, clients: int) -> None:
+    for _ in range(clients):
+        event_type = channel.split(":")[-1]
+        ServerSentEvent(event=event_type, data=json.dumps({
+            "server_time": datetime.now().timestamp(),
+            **json.loads(data)
+        })).encode()
+
+
+def shared_encoding(channel: bytes, data: bytes, clients: int) -> None:
+    frame = encode_event_frame(channel.rsplit(b":", 1)[-1], data, time.time())
+    frames = []
+    for _ in range(clients):
+        frames.append(frame)
+
+
+def run(label: str, fn, channel, data, clients: int, events: int) -> float:
+    start = time.perf_counter()
+    for _ in range(events):
+        fn(channel, data, clients)
+    elapsed = time.perf_counter() - start
+    per_client_ns = elapsed / (clients * events) * 1e9
+    print(f"{label:>8}: {elapsed * 1000:8.1f} ms total, {per_client_ns:8.1f} ns per client per event")
+    return per_client_ns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+
+    data = json.dumps(SAMPLE_PAYLOAD)
+    before = run("before", per_client_encoding, "game_events:candidate_vote", data, args.clients, args.events)
+    after = run("after", shared_encoding, b"game_events:candidate_vote", data.encode(), args.clients, args.events)
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Measures how the game's hot paths scale with the size of the game, and records the results as JSON
+so runs on different commits can be compared.
+
+get_game_state: full snapshot read, by story length and candidate count
+vote:           a vote toggle on a live candidate, by story length and candidate count
+promote:        the vote that moves a candidate's phrase into the story, by story length
+flag_word:      a flag toggle on a story word, by story length
+remove_word:    the flag that cuts a word out of the story, by story length
+get_story:      story read used for resyncs, by story length
+fanout:         one event dispatched by the EventHub to every subscriber of a worker, by subscriber count
+
+The Redis engine runs against REDIS_HOST/REDIS_PORT/REDIS_USERNAME/REDIS_PASSWORD and wipes the room it plays in,
+the memory engine needs nothing running.
+
+Usage: python bench/bench_hot_paths.py [--engines redis,memory] [--story-sizes 10,1000,10000,100000]
+                                       [--candidate-counts 10,100,1000] [--subscriber-counts 10,1000,10000]
+                                       [--operations 200] [--case-seconds 3] [--room bench] [--output results.json]
+                                       [--compare baseline.json] [--tolerance 0.25]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import zibbit  # noqa: E402
+from zibbit import ZibbitGame  # noqa: E402
+from memory_store import MemoryGameStore  # noqa: E402
+from event_hub import EventHub  # noqa: E402
+
+# Words per seeded phrase, so the story grows by this many words per promoted candidate
+SEED_PHRASE_WORDS = 5
+# Seeded candidates outlive any run
+SEED_DECAY_SECONDS = 3600
+# Results faster than this are within timer noise, so they're never reported as regressions
+REGRESSION_FLOOR_MS = 0.01
+
+
+def make_game(engine: str, room_id: str) -> ZibbitGame:
+    if engine == "memory":
+        return ZibbitGame(store=MemoryGameStore(room_id=room_id))
+    return ZibbitGame(
+        redis_host=os.getenv("REDIS_HOST", "localhost"),
+        redis_port=int(os.getenv("REDIS_PORT", "6379")),
+        redis_user=os.getenv("REDIS_USERNAME"),
+        redis_pass=os.getenv("REDIS_PASSWORD"),
+        room_id=room_id)
+
+
+def parse_sizes(value: str) -> list[int]:
+    return sorted(int(size) for size in value.split(",") if size.strip())
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+class Seeder:
+    """Grows a room's story and candidate list through the store, skipping the per-request validation."""
+
+    def __init__(self, zg: ZibbitGame):
+        self.zg = zg
+        self.phrases = 0
+        self.candidate_ids = []
+        self.story_length = 0
+
+    async def reset(self) -> None:
+        await self.zg.clear_game()
+        self.candidate_ids = []
+        self.story_length = 0
+
+    async def add_candidate(self) -> int:
+        self.phrases += 1
+        phrase = " ".join(f"seed{self.phrases}w{idx}" for idx in range(SEED_PHRASE_WORDS))
+        return await self.zg.store.submit_candidate(phrase, "10.9.0.1", time.time(), SEED_DECAY_SECONDS, 1)
+
+    async def add_candidates(self, count: int) -> None:
+        while len(self.candidate_ids) < count:
+            self.candidate_ids.append(await self.add_candidate())
+
+    async def grow_story(self, length: int) -> None:
+        while self.story_length < length:
+            # A threshold of one promotes the candidate on its first vote
+            await self.zg.store.vote(await self.add_candidate(), "10.9.0.2", time.time(), 1, 1)
+            self.story_length += SEED_PHRASE_WORDS
+
+    async def word_ids(self) -> list[int]:
+        return [itm["word_id"] for itm in (await self.zg.get_story())["story"]]
+
+
+async def measure(operations: int, operation, max_seconds: float) -> dict:
+    """
+    Times `operation` over and over, minus the seconds it reports as setup (if any).
+    Stops early once `max_seconds` have gone by, so the slowest cases still finish in reasonable time.
+    """
+    latencies = []
+    deadline = time.perf_counter() + max_seconds
+    for op_idx in range(operations):
+        start = time.perf_counter()
+        excluded = await operation(op_idx)
+        latencies.append(time.perf_counter() - start - (excluded or 0))
+        if start > deadline:
+            break
+    return {
+        "operations": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def report(results: list, bench: str, engine: str, params: dict, measured: dict) -> None:
+    results.append({"bench": bench, "engine": engine, "params": params, **measured})
+    described = ", ".join(f"{name}={value}" for name, value in params.items())
+    print(f"{engine:>8} {bench:>14} {described:<34} p50 {measured['p50_ms']:9.3f} ms, "
+          f"p99 {measured['p99_ms']:9.3f} ms")
+
+
+async def bench_engine(engine: str, zg: ZibbitGame, args, results: list) -> None:
+    seeder = Seeder(zg)
+    rng = random.Random(0)
+    # Keep the measured votes and flags from promoting candidates or removing words, unless a bench asks to
+    zibbit.CANDIDATE_VOTE_THRESHOLD = 1_000_000
+    zibbit.WORD_FLAG_THRESHOLD = 1_000_000
+
+    for candidate_count in args.candidate_counts:
+        await seeder.reset()
+        await seeder.add_candidates(candidate_count)
+        for story_length in args.story_sizes:
+            await seeder.grow_story(story_length)
+            params = {"story_words": story_length, "candidates": candidate_count}
+
+            async def get_game_state(op_idx):
+                await zg.get_game_state()
+            measured = await measure(args.operations, get_game_state, args.case_seconds)
+            report(results, "get_game_state", engine, params, measured)
+
+            async def vote(op_idx):
+                # Each voter votes on even operations and un-votes on odd ones, so vote counts stay flat
+                await zg.handle_vote(f"10.8.0.{op_idx // 2 % 256}", seeder.candidate_ids[op_idx // 2 % candidate_count])
+            measured = await measure(args.operations, vote, args.case_seconds)
+            report(results, "vote", engine, params, measured)
+
+            if candidate_count != args.candidate_counts[0]:
+                # The rest only depends on the story
+                continue
+            params = {"story_words": story_length}
+            word_ids = await seeder.word_ids()
+
+            async def get_story(op_idx):
+                await zg.get_story()
+            measured = await measure(args.operations, get_story, args.case_seconds)
+            report(results, "get_story", engine, params, measured)
+
+            async def flag_word(op_idx):
+                await zg.handle_word_flag("10.8.1.1", word_ids[op_idx // 2 % len(word_ids)])
+            measured = await measure(args.operations, flag_word, args.case_seconds)
+            report(results, "flag_word", engine, params, measured)
+
+            removed_word_ids = rng.sample(word_ids, min(args.operations, len(word_ids)))
+            zibbit.WORD_FLAG_THRESHOLD = 1
+
+            async def remove_word(op_idx):
+                await zg.handle_word_flag("10.8.1.1", removed_word_ids[op_idx])
+            measured = await measure(len(removed_word_ids), remove_word, args.case_seconds)
+            report(results, "remove_word", engine, params, measured)
+            zibbit.WORD_FLAG_THRESHOLD = 1_000_000
+            seeder.story_length -= measured["operations"]
+
+            promoted_ids = [await seeder.add_candidate() for _ in range(args.operations)]
+            zibbit.CANDIDATE_VOTE_THRESHOLD = 1
+
+            async def promote(op_idx):
+                await zg.handle_vote("10.8.2.1", promoted_ids[op_idx])
+            measured = await measure(args.operations, promote, args.case_seconds)
+            report(results, "promote", engine, params, measured)
+            zibbit.CANDIDATE_VOTE_THRESHOLD = 1_000_000
+            seeder.story_length += measured["operations"] * SEED_PHRASE_WORDS
+    await zg.clear_game()
+
+
+async def bench_fanout(zg: ZibbitGame, args, results: list) -> None:
+    await zg.clear_game()
+    candidate_id = await Seeder(zg).add_candidate()
+    for subscriber_count in args.subscriber_counts:
+        hub = EventHub(zg)
+        await hub.snapshot_cache.get()
+        subscriptions = [hub.subscribe() for _ in range(subscriber_count)]
+
+        async def dispatch(op_idx):
+            data = json.dumps({
+                "seq": hub.snapshot_cache.seq + 1,
+                "candidate_id": candidate_id,
+                "phrase": "seed",
+                "votes": [f"10.8.0.{op_idx % 256}"],
+                "creator": "10.9.0.1",
+                "expiration_utc_time": time.time() + SEED_DECAY_SECONDS
+            }).encode()
+            hub.dispatch(b"candidate_vote", data)
+            # Stand-in for the clients' SSE loops, which run between dispatches in the server
+            drain_start = time.perf_counter()
+            for subscription in subscriptions:
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+            return time.perf_counter() - drain_start
+
+        measured = await measure(args.operations, dispatch, args.case_seconds)
+        report(results, "fanout", "hub", {"subscribers": subscriber_count}, measured)
+        hub.drop_all()
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list[str]:
+    """Returns a line per result whose p50 got slower than the baseline's by more than `tolerance`."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def result_key(result):
+        return result["bench"], result["engine"], json.dumps(result["params"], sort_keys=True)
+
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result_key(result))
+        if previous is None or result["p50_ms"] < REGRESSION_FLOOR_MS:
+            continue
+        if result["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{result['engine']} {result['bench']} {result['params']}: "
+                               f"p50 {previous['p50_ms']:.3f} -> {result['p50_ms']:.3f} ms")
+    print(f"compared with {baseline_path} ({baseline['meta'].get('commit')}): "
+          f"{len(regressions)} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", default="redis,memory")
+    parser.add_argument("--story-sizes", type=parse_sizes, default=parse_sizes("10,1000,10000,100000"))
+    parser.add_argument("--candidate-counts", type=parse_sizes, default=parse_sizes("10,100,1000"))
+    parser.add_argument("--subscriber-counts", type=parse_sizes, default=parse_sizes("10,1000,10000"))
+    parser.add_argument("--operations", type=int, default=200)
+    # Cases stop short of --operations once they've run this long
+    parser.add_argument("--case-seconds", type=float, default=3)
+    parser.add_argument("--room", default="bench")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    engines = args.engines.split(",")
+
+    results = []
+    games = {engine: make_game(engine, args.room) for engine in engines}
+    for engine, zg in games.items():
+        await bench_engine(engine, zg, args, results)
+    # The hub only sees bytes, so any engine will do
+    await bench_fanout(games[engines[-1]], args, results)
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
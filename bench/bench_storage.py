@@ -0,0 +1,136 @@
+"""
+Compares the storage engines on the same workload, and checks they behave the same.
+
+parity:     plays one scripted game on each engine and compares the resulting game states
+            (the behaviour both engines must share is tested in tests/test_game_store.py)
+throughput: concurrent clients submitting, voting, flagging and reading the game state,
+            reporting operations per second and per-operation p50 / p99 latency
+
+The Redis engine runs against REDIS_HOST/REDIS_PORT/REDIS_USERNAME/REDIS_PASSWORD and wipes the room it plays in.
+
+Usage: python bench/bench_storage.py [--engines redis,memory] [--clients 50] [--operations 2000] [--room bench]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import zibbit  # noqa: E402
+from zibbit import ZibbitGame  # noqa: E402
+from memory_store import MemoryGameStore  # noqa: E402
+
+
+def make_game(engine: str, room_id: str) -> ZibbitGame:
+    if engine == "memory":
+        return ZibbitGame(store=MemoryGameStore(room_id=room_id))
+    return ZibbitGame(
+        redis_host=os.getenv("REDIS_HOST", "localhost"),
+        redis_port=int(os.getenv("REDIS_PORT", "6379")),
+        redis_user=os.getenv("REDIS_USERNAME"),
+        redis_pass=os.getenv("REDIS_PASSWORD"),
+        room_id=room_id)
+
+
+def comparable_state(game_state: dict) -> dict:
+    # Drops what depends on timing or set ordering
+    return {
+        "story": [(itm["word_id"], itm["word"], sorted(itm["flags"]), itm["creator"]) for itm in game_state["story"]],
+        "story_version": game_state["story_version"],
+        "candidates": sorted((itm["candidate_id"], itm["phrase"], sorted(itm["votes"]), itm["creator"])
+                             for itm in game_state["candidates"]),
+        "user_count": game_state["user_count"]
+    }
+
+
+async def play_scripted_game(zg: ZibbitGame) -> tuple[list, dict]:
+    """Returns the result of every action and the final game state."""
+    await zg.clear_game()
+    results = [
+        await zg.handle_phrase_submission("10.0.0.1", "once upon a"),
+        await zg.handle_phrase_submission("10.0.0.2", "once upon a"),
+        await zg.handle_phrase_submission("10.0.0.2", "time there"),
+        await zg.handle_vote("10.0.0.1", 2),
+        await zg.handle_vote("10.0.0.2", 2),
+        await zg.handle_vote("10.0.0.3", 2),
+        await zg.handle_vote("10.0.0.3", 2),
+        await zg.handle_vote("10.0.0.3", 2),
+        await zg.handle_vote("10.0.0.4", 2),
+        await zg.handle_vote("10.0.0.1", 3),
+        await zg.handle_vote("10.0.0.9", 99),
+        await zg.handle_word_flag("10.0.0.1", 3),
+        await zg.handle_word_flag("10.0.0.2", 3),
+        await zg.handle_word_flag("10.0.0.2", 3),
+        await zg.handle_word_flag("10.0.0.2", 3),
+        await zg.handle_word_flag("10.0.0.3", 3),
+        await zg.handle_word_flag("10.0.0.1", 42),
+    ]
+    return results, comparable_state(await zg.get_game_state())
+
+
+async def run_client(zg: ZibbitGame, client_idx: int, operations: int, latencies: dict) -> None:
+    rng = random.Random(client_idx)
+    client_ip = f"10.1.{client_idx // 256}.{client_idx % 256}"
+    for op_idx in range(operations):
+        action = rng.choices(["submit", "vote", "flag", "read"], weights=[1, 6, 1, 2])[0]
+        start = time.perf_counter()
+        if action == "submit":
+            await zg.handle_phrase_submission(client_ip, f"phrase {client_idx} {op_idx}")
+        elif action == "vote":
+            await zg.handle_vote(client_ip, rng.randint(2, 50))
+        elif action == "flag":
+            await zg.handle_word_flag(client_ip, rng.randint(2, 50))
+        else:
+            await zg.get_game_state()
+        latencies.setdefault(action, []).append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def run_throughput(engine: str, zg: ZibbitGame, clients: int, operations: int) -> None:
+    await zg.clear_game()
+    # Keep the candidates of the run alive and the story growing
+    zibbit.CANDIDATE_DECAY_SECONDS = 600
+    latencies = {}
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(zg, idx, operations // clients, latencies) for idx in range(clients)])
+    elapsed = time.perf_counter() - start
+    total = sum(len(values) for values in latencies.values())
+    print(f"{engine:>8}: {total / elapsed:10.0f} ops/s over {total} ops from {clients} clients")
+    for action, values in sorted(latencies.items()):
+        print(f"{'':>8}  {action:>6}: p50 {percentile(values, 0.5) * 1000:8.3f} ms, "
+              f"p99 {percentile(values, 0.99) * 1000:8.3f} ms")
+    await zg.clear_game()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", default="redis,memory")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--room", default="bench")
+    args = parser.parse_args()
+    engines = args.engines.split(",")
+
+    games = {engine: make_game(engine, args.room) for engine in engines}
+    outcomes = {engine: await play_scripted_game(zg) for engine, zg in games.items()}
+    reference_engine, reference = engines[0], outcomes[engines[0]]
+    parity = all(outcome == reference for outcome in outcomes.values())
+    for engine, outcome in outcomes.items():
+        if outcome != reference:
+            print(f"FAIL {engine} differs from {reference_engine}:\n  {outcome}\n  {reference}")
+    print(f"parity: {'OK' if parity else 'FAILED'} across {', '.join(engines)}")
+
+    for engine, zg in games.items():
+        await run_throughput(engine, zg, args.clients, args.operations)
+    sys.exit(0 if parity else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
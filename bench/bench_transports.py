@@ -0,0 +1,112 @@
+"""
+Compares how many player actions a running server answers per second over each transport:
+
+http: one POST per action on a keep-alive connection, as script.js sends them without WebSockets
+ws:   one JSON message per action on the /ws connection, answered by an ack
+
+Every client sends its next action as soon as the previous one is answered, with its own x-forwarded-for.
+The action is a vote on a candidate that doesn't exist, so each one runs the rate limiter and the game's
+vote handler without changing the game, and what's measured is the cost of getting it to the handler and back.
+Run the server with RATE_LIMIT_VOTE=0, otherwise most actions are answered with a 429 (counted separately).
+
+Usage: python bench/bench_transports.py [--target http://localhost:8000] [--room default]
+                                         [--client-counts 1,10,50] [--seconds 10] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import platform
+import time
+from collections import Counter
+
+import httpx
+import websockets
+
+# Candidate id no game reaches, so the votes are all turned down by the handler
+MISSING_CANDIDATE_ID = 2 ** 62
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def run_http_client(args, client_idx: int, deadline: float, latencies: list, statuses: Counter) -> None:
+    headers = {"x-forwarded-for": f"10.7.{client_idx // 256}.{client_idx % 256}"}
+    async with httpx.AsyncClient(base_url=args.target, headers=headers, timeout=30) as client:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.post(f"/rooms/{args.room}/vote", json={"candidate_id": MISSING_CANDIDATE_ID})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+
+async def run_ws_client(args, client_idx: int, deadline: float, latencies: list, statuses: Counter) -> None:
+    headers = {"x-forwarded-for": f"10.7.{client_idx // 256}.{client_idx % 256}"}
+    url = args.target.replace("http", "ws", 1) + f"/rooms/{args.room}/ws"
+    async with websockets.connect(url, extra_headers=headers, max_size=None) as ws:
+        action_id = 0
+        while time.perf_counter() < deadline:
+            action_id += 1
+            start = time.perf_counter()
+            await ws.send(json.dumps({"id": action_id, "action": "vote", "candidate_id": MISSING_CANDIDATE_ID}))
+            while True:
+                message = await ws.recv()
+                # Game events (binary) arrive on the same connection, skip them
+                if isinstance(message, str) and json.loads(message)["ack"] == action_id:
+                    break
+            latencies.append(time.perf_counter() - start)
+            statuses[json.loads(message)["status"]] += 1
+
+
+async def bench_transport(args, transport: str, client_count: int) -> dict:
+    run_client = run_http_client if transport == "http" else run_ws_client
+    latencies, statuses = [], Counter()
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    await asyncio.gather(*(run_client(args, client_idx, deadline, latencies, statuses)
+                           for client_idx in range(client_count)))
+    elapsed = time.perf_counter() - start
+    return {
+        "transport": transport,
+        "clients": client_count,
+        "actions": len(latencies),
+        "actions_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--room", default="default")
+    parser.add_argument("--client-counts", default="1,10,50")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = []
+    for client_count in sorted(int(count) for count in args.client_counts.split(",") if count.strip()):
+        for transport in ("http", "ws"):
+            result = await bench_transport(args, transport, client_count)
+            results.append(result)
+            print(f"{transport:>4} clients={client_count:<5} {result['actions_per_second']:9.0f} actions/s, "
+                  f"p50 {result['p50_ms']:7.3f} ms, p99 {result['p99_ms']:7.3f} ms, statuses {result['statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "timestamp": time.time(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "args": {name: value for name, value in vars(args).items() if name != "output"},
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
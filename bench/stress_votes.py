@@ -0,0 +1,97 @@
+"""
+Fires concurrent votes at a single candidate and checks that none of them are lost,
+and that a candidate crossing the vote threshold is promoted into the story exactly once.
+
+Runs against the Redis configured by REDIS_HOST/REDIS_PORT/REDIS_USERNAME/REDIS_PASSWORD,
+or the in-process store with --engine memory. It wipes the game keys of the room it plays in,
+so point it at a scratch Redis (or room).
+
+Usage: python bench/stress_votes.py [--voters 500] [--rounds 5] [--room stress] [--engine redis|memory]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import zibbit  # noqa: E402
+from zibbit import ZibbitGame  # noqa: E402
+from memory_store import MemoryGameStore  # noqa: E402
+
+
+async def count_votes(zg: ZibbitGame, candidate_id: int) -> int | None:
+    game_state = await zg.get_game_state()
+    for candidate in game_state["candidates"]:
+        if candidate["candidate_id"] == candidate_id:
+            return len(candidate["votes"])
+    return None
+
+
+async def run_round(zg: ZibbitGame, round_number: int, voters: int) -> list[str]:
+    failures = []
+    await zg.clear_game()
+    phrase = f"stress round {round_number}"
+    voter_ips = [f"10.{round_number}.{idx // 256}.{idx % 256}" for idx in range(voters)]
+
+    # Nobody reaches the threshold while we count votes
+    zibbit.CANDIDATE_VOTE_THRESHOLD = voters + 1
+    await zg.handle_phrase_submission("creator", phrase)
+    game_state = await zg.get_game_state()
+    candidate_id = next(itm["candidate_id"] for itm in game_state["candidates"] if itm["phrase"] == phrase)
+
+    results = await asyncio.gather(*[zg.handle_vote(ip, candidate_id) for ip in voter_ips])
+    counted = await count_votes(zg, candidate_id)
+    if not all(results) or counted != voters:
+        failures.append(f"round {round_number}: {voters} concurrent votes, {counted} counted")
+
+    # Every other voter un-votes at the same time
+    unvoters = voter_ips[::2]
+    await asyncio.gather(*[zg.handle_vote(ip, candidate_id) for ip in unvoters])
+    counted = await count_votes(zg, candidate_id)
+    if counted != voters - len(unvoters):
+        failures.append(f"round {round_number}: {len(unvoters)} concurrent un-votes, {counted} votes left "
+                        f"(expected {voters - len(unvoters)})")
+
+    # The un-voters vote again, crossing the threshold together: the phrase must land in the story exactly once
+    zibbit.CANDIDATE_VOTE_THRESHOLD = voters
+    await asyncio.gather(*[zg.handle_vote(ip, candidate_id) for ip in unvoters])
+    story_length = len((await zg.get_story())["story"])
+    if story_length != len(phrase.split(" ")):
+        failures.append(f"round {round_number}: promoted story has {story_length} words "
+                        f"(expected {len(phrase.split(' '))})")
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--voters", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--room", default="stress")
+    parser.add_argument("--engine", choices=["redis", "memory"], default="redis")
+    args = parser.parse_args()
+
+    if args.engine == "memory":
+        zg = ZibbitGame(store=MemoryGameStore(room_id=args.room))
+    else:
+        zg = ZibbitGame(
+            redis_host=os.getenv("REDIS_HOST", "localhost"),
+            redis_port=int(os.getenv("REDIS_PORT", "6379")),
+            redis_user=os.getenv("REDIS_USERNAME"),
+            redis_pass=os.getenv("REDIS_PASSWORD"),
+            room_id=args.room)
+
+    failures = []
+    for round_number in range(args.rounds):
+        failures.extend(await run_round(zg, round_number, args.voters))
+    await zg.clear_game()
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{args.engine}: {args.rounds} rounds x {args.voters} concurrent voters: "
+          f"{'FAILED' if failures else 'no votes lost'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import redis_store  # noqa: E402
+from memory_store import MemoryGameStore  # noqa: E402
+from redis_store import RedisGameStore  # noqa: E402
+
+# Room every test plays in
+TEST_ROOM_ID = "test"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def store(request, monkeypatch):
+    """A fresh store of each engine, in event log mode so tests can read back the events they caused."""
+    if request.param == "memory":
+        yield MemoryGameStore(event_log=True, room_id=TEST_ROOM_ID)
+        return
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    # Every client the store opens talks to the same in-process server
+    monkeypatch.setattr(redis_store.redis, "StrictRedis",
+                        lambda decode_responses, **_: fakeredis.FakeAsyncRedis(server=server,
+                                                                              decode_responses=decode_responses))
+    store = RedisGameStore(event_log=True, room_id=TEST_ROOM_ID)
+    yield store
+    await store.close()
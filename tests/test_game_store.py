@@ -0,0 +1,312 @@
+"""
+Behaviour every GameStore engine has to share. Each test runs against MemoryGameStore and RedisGameStore.
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+import memory_store
+import redis_store
+
+pytestmark = pytest.mark.anyio
+
+LEADER = "leader-worker"
+OTHER_WORKER = "other-worker"
+CREATOR_IP = "10.0.0.1"
+VOTE_THRESHOLD = 3
+FLAG_THRESHOLD = 3
+DECAY_SECONDS = 30
+COOLDOWN_SECONDS = 30
+
+
+async def read_events(store, after: str = "0-0") -> list[tuple[str, dict]]:
+    return [(event_type.decode(), json.loads(data)) for _, event_type, data, _ in await store.read_event_log(after, 1)]
+
+
+async def event_types(store) -> list[str]:
+    return [event_type for event_type, _ in await read_events(store)]
+
+
+async def read_candidates(store) -> dict[int, tuple[str, list[str]]]:
+    """Live candidates as candidate id -> (phrase, sorted votes)."""
+    candidates = (await store.read_game_state())[5]
+    return {int(candidate_id): (phrase, sorted(votes)) for candidate_id, phrase, _, _, votes in candidates}
+
+
+async def read_story(store) -> list[tuple[int, str, list[str]]]:
+    """The story as [(word id, word, sorted flags), ...]."""
+    _, words = await store.read_story()
+    return [(int(word_id), word, sorted(flags)) for word_id, word, _, flags in words]
+
+
+async def submit(store, phrase: str, client_ip: str = CREATOR_IP, now: float | None = None,
+                 decay_seconds: int = DECAY_SECONDS, cooldown_seconds: int = COOLDOWN_SECONDS) -> int | None:
+    return await store.submit_candidate(phrase, client_ip, time.time() if now is None else now,
+                                        decay_seconds, cooldown_seconds)
+
+
+async def vote(store, candidate_id: int, client_ip: str) -> int | None:
+    return await store.vote(candidate_id, client_ip, time.time(), VOTE_THRESHOLD, COOLDOWN_SECONDS)
+
+
+async def promote(store, phrase: str) -> list[int]:
+    """Votes a phrase into the story, returns the ids of its words."""
+    candidate_id = await submit(store, phrase)
+    for voter in range(VOTE_THRESHOLD):
+        await vote(store, candidate_id, f"10.1.0.{voter}")
+    return [word_id for word_id, word, _ in await read_story(store) if word in phrase.split()]
+
+
+# Votes
+
+async def test_vote_toggles(store):
+    candidate_id = await submit(store, "hello")
+
+    assert await vote(store, candidate_id, "10.1.0.1") == 1
+    assert (await read_candidates(store))[candidate_id] == ("hello", ["10.1.0.1"])
+    # Voting again takes the vote back
+    assert await vote(store, candidate_id, "10.1.0.1") == 1
+    assert (await read_candidates(store))[candidate_id] == ("hello", [])
+
+
+async def test_vote_refused_for_own_or_missing_candidate(store):
+    candidate_id = await submit(store, "hello")
+
+    assert await vote(store, candidate_id, CREATOR_IP) is None
+    assert await vote(store, candidate_id + 100, "10.1.0.1") is None
+    assert (await read_candidates(store))[candidate_id] == ("hello", [])
+
+
+async def test_new_vote_extends_candidate(store):
+    candidate_id = await submit(store, "hello")
+    _, submit_event = (await read_events(store))[-1]
+
+    await vote(store, candidate_id, "10.1.0.1")
+
+    _, vote_event = (await read_events(store))[-1]
+    assert vote_event["expiration_utc_time"] > submit_event["expiration_utc_time"]
+
+
+async def test_vote_promotes_candidate_at_threshold(store):
+    candidate_id = await submit(store, "once upon")
+    for voter in range(VOTE_THRESHOLD - 1):
+        assert await vote(store, candidate_id, f"10.1.0.{voter}") == 1
+    assert await read_story(store) == []
+
+    assert await vote(store, candidate_id, "10.1.0.9") == 2
+
+    assert candidate_id not in await read_candidates(store)
+    assert [word for _, word, _ in await read_story(store)] == ["once", "upon"]
+    story_version, _ = await store.read_story()
+    assert int(story_version) == 1
+    assert (await event_types(store))[-2:] == ["candidate_vote", "words_appended"]
+
+
+# Flags
+
+async def test_flag_toggles(store):
+    word_id, = await promote(store, "hello")
+
+    assert await store.flag_word(word_id, "10.2.0.1", FLAG_THRESHOLD) == 1
+    assert await read_story(store) == [(word_id, "hello", ["10.2.0.1"])]
+    # Flagging again takes the flag back
+    assert await store.flag_word(word_id, "10.2.0.1", FLAG_THRESHOLD) == 1
+    assert await read_story(store) == [(word_id, "hello", [])]
+
+
+async def test_flag_removes_word_at_threshold(store):
+    first_word_id, flagged_word_id, last_word_id = await promote(store, "a bad word")
+    for flagger in range(FLAG_THRESHOLD - 1):
+        assert await store.flag_word(flagged_word_id, f"10.2.0.{flagger}", FLAG_THRESHOLD) == 1
+
+    assert await store.flag_word(flagged_word_id, "10.2.0.9", FLAG_THRESHOLD) == 2
+
+    assert await read_story(store) == [(first_word_id, "a", []), (last_word_id, "word", [])]
+    story_version, _ = await store.read_story()
+    assert int(story_version) == 2
+    assert await store.flag_word(flagged_word_id, "10.2.0.8", FLAG_THRESHOLD) is None
+
+
+# Phrase cooldown
+
+async def test_phrase_cooldown(store):
+    assert await submit(store, "hello", cooldown_seconds=1) is not None
+    assert await submit(store, "hello", client_ip="10.3.0.1", cooldown_seconds=1) is None
+    assert await submit(store, "other phrase", cooldown_seconds=1) is not None
+
+    await asyncio.sleep(1.1)
+
+    assert await submit(store, "hello", client_ip="10.3.0.1", cooldown_seconds=1) is not None
+
+
+# Timer lease
+
+async def test_lease_has_a_single_holder(store):
+    assert await store.acquire_timer_lease(LEADER, 30)
+    assert not await store.acquire_timer_lease(OTHER_WORKER, 30)
+    # The holder extends it
+    assert await store.acquire_timer_lease(LEADER, 30)
+
+    await store.release_timer_lease(OTHER_WORKER)
+    assert not await store.acquire_timer_lease(OTHER_WORKER, 30)
+    await store.release_timer_lease(LEADER)
+    assert await store.acquire_timer_lease(OTHER_WORKER, 30)
+
+
+async def test_set_game_phase_is_fenced_by_lease(store):
+    await store.acquire_timer_lease(LEADER, 30)
+
+    assert not await store.set_game_phase(OTHER_WORKER, "game_end", {"game_status": "COOLDOWN"})
+    assert (await store.get_game_phase())[0] is None
+    assert await store.set_game_phase(LEADER, "game_end", {"game_status": "COOLDOWN"})
+    assert (await store.get_game_phase())[0] == "COOLDOWN"
+    assert await event_types(store) == ["game_end"]
+
+
+async def test_start_game_is_fenced_by_lease(store):
+    await store.acquire_timer_lease(LEADER, 30)
+    word_ids = await promote(store, "old story")
+    candidate_id = await submit(store, "old candidate")
+
+    assert not await store.start_game(OTHER_WORKER, "game_start", {"game_status": "IN_PLAY"})
+    assert [word_id for word_id, _, _ in await read_story(store)] == word_ids
+    assert candidate_id in await read_candidates(store)
+
+    assert await store.start_game(LEADER, "game_start", {"game_status": "IN_PLAY"})
+    assert await read_story(store) == []
+    assert await read_candidates(store) == {}
+    assert (await store.get_game_phase())[0] == "IN_PLAY"
+    # Phrase cooldowns are gone too
+    assert await submit(store, "old candidate") is not None
+
+
+async def test_expire_candidates_is_fenced_by_lease(store):
+    await store.acquire_timer_lease(LEADER, 30)
+    now = time.time()
+    candidate_id = await submit(store, "hello", now=now, decay_seconds=10)
+
+    assert await store.expire_candidates(OTHER_WORKER, now + 11) is None
+    assert candidate_id in await read_candidates(store)
+    assert "candidate_expired" not in await event_types(store)
+
+
+# Candidate expiry
+
+async def test_expire_candidates(store):
+    await store.acquire_timer_lease(LEADER, 30)
+    now = time.time()
+    short_lived_id = await submit(store, "short", now=now, decay_seconds=10)
+    long_lived_id = await submit(store, "long", now=now, decay_seconds=20)
+
+    # Nothing is due yet, the next expiration is returned
+    assert await store.expire_candidates(LEADER, now + 5) == pytest.approx(now + 10, abs=0.01)
+
+    assert await store.expire_candidates(LEADER, now + 11) == pytest.approx(now + 20, abs=0.01)
+    events = await read_events(store)
+    assert events[-1] == ("candidate_expired", {"seq": events[-1][1]["seq"], "candidate_id": short_lived_id})
+    assert await store.vote(short_lived_id, "10.1.0.1", now + 11, VOTE_THRESHOLD, COOLDOWN_SECONDS) is None
+
+    assert await store.expire_candidates(LEADER, now + 21) is None
+    assert [event_type for event_type in await event_types(store)].count("candidate_expired") == 2
+    assert long_lived_id not in await read_candidates(store)
+
+
+# Rate limit
+
+async def test_rate_limit_wait(store):
+    now = 1000.0
+    assert await store.hit_rate_limit("vote", "10.4.0.1", 2, 10, now) == 0
+    assert await store.hit_rate_limit("vote", "10.4.0.1", 2, 10, now + 1) == 0
+
+    # Blocked until the oldest request leaves the window
+    assert await store.hit_rate_limit("vote", "10.4.0.1", 2, 10, now + 2) == pytest.approx(8)
+    # Other clients and actions have their own windows
+    assert await store.hit_rate_limit("vote", "10.4.0.2", 2, 10, now + 2) == 0
+    assert await store.hit_rate_limit("flag_word", "10.4.0.1", 2, 10, now + 2) == 0
+
+    assert await store.hit_rate_limit("vote", "10.4.0.1", 2, 10, now + 10.5) == 0
+
+
+# Presence
+
+async def test_presence_sums_live_workers(store):
+    await store.acquire_timer_lease(LEADER, 30)
+    now = 1000.0
+    await store.heartbeat_presence("worker-1", 3, now, 10)
+    await store.heartbeat_presence("worker-2", 4, now + 5, 10)
+
+    assert await store.broadcast_presence(LEADER, now + 8) == 7
+    # worker-1's heartbeat ran out
+    assert await store.broadcast_presence(LEADER, now + 12) == 4
+    assert await store.broadcast_presence(LEADER, now + 16) == 0
+
+    assert [payload["user_count"] for event_type, payload in await read_events(store)
+            if event_type == "user_count"] == [7, 4, 0]
+
+
+async def test_presence_only_announces_changes(store):
+    await store.acquire_timer_lease(LEADER, 30)
+    await store.heartbeat_presence("worker-1", 3, 1000.0, 10)
+
+    assert await store.broadcast_presence(LEADER, 1001.0) == 3
+    assert await store.broadcast_presence(LEADER, 1002.0) == 3
+    assert await event_types(store) == ["user_count"]
+
+
+async def test_broadcast_presence_is_fenced_by_lease(store):
+    await store.acquire_timer_lease(LEADER, 30)
+    await store.heartbeat_presence("worker-1", 3, 1000.0, 10)
+
+    assert await store.broadcast_presence(OTHER_WORKER, 1001.0) is None
+    assert await event_types(store) == []
+
+
+# Event log
+
+async def test_events_are_numbered_in_order(store):
+    candidate_id = await submit(store, "hello")
+    await vote(store, candidate_id, "10.1.0.1")
+
+    seqs = [payload["seq"] for _, payload in await read_events(store)]
+    assert seqs == [1, 2]
+    assert (await store.read_game_state())[0] == 2
+
+
+async def test_get_events_since(store):
+    await submit(store, "first")
+    first_event_id = await store.get_latest_event_id()
+    await submit(store, "second")
+    await submit(store, "third")
+
+    resumed = await store.get_events_since(first_event_id)
+
+    assert resumed is not None
+    last_seq, missed_events = resumed
+    assert last_seq == 1
+    assert [(seq, json.loads(data)["phrase"]) for _, _, data, seq in missed_events] == [(2, "second"), (3, "third")]
+    assert await store.get_events_since(await store.get_latest_event_id()) == (3, [])
+
+
+async def test_get_events_since_trimmed_event(store, monkeypatch):
+    monkeypatch.setattr(redis_store, "GAME_EVENTS_STREAM_MAX_LENGTH", 10)
+    monkeypatch.setattr(memory_store, "EVENT_LOG_MAX_LENGTH", 10)
+    store = store.for_room("trimmed")
+    await submit(store, "first")
+    first_event_id = await store.get_latest_event_id()
+    for phrase_idx in range(300):
+        await submit(store, f"phrase {phrase_idx}")
+
+    # The client has to fall back to a full snapshot
+    assert await store.get_events_since(first_event_id) is None
+    assert await store.get_events_since("not-an-id") is None
+
+
+async def test_events_carry_publish_time(store):
+    before = time.time()
+    await submit(store, "hello")
+    after = time.time()
+
+    (_, _, _, published_at), = await store.read_event_log("0-0", 1)
+    assert before - 0.01 <= published_at <= after + 0.01